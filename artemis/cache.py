@@ -0,0 +1,107 @@
+import threading
+import time
+
+
+class ClusterStateCache(object):
+    """In-memory snapshot of the pods and services in the managed namespaces.
+
+    One background thread per kind lists the objects once and then follows a
+    watch stream, re-listing whenever the stream reports an error. Backends
+    without watch support are re-listed every poll_interval seconds instead.
+    """
+
+    KINDS = ('Pod', 'Service')
+
+    def __init__(self, kube, namespaces, poll_interval=10, watch_timeout=300, retry_interval=5):
+        self.kube = kube
+        self.namespaces = namespaces
+        self.poll_interval = poll_interval
+        self.watch_timeout = watch_timeout
+        self.retry_interval = retry_interval
+        self.objects = dict((kind, {}) for kind in self.KINDS)
+        self.synced_at = dict((kind, None) for kind in self.KINDS)
+        self.live = dict((kind, False) for kind in self.KINDS)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.threads = []
+
+    def start(self):
+        for kind in self.KINDS:
+            t = threading.Thread(target=self.__follow, args=(kind,), name="cluster-cache-%s" % kind)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def stop(self):
+        self.stopped.set()
+
+    def get_age(self, kind):
+        """Seconds since the snapshot of kind was last known to be current, or None if it never was."""
+        with self.lock:
+            if self.live[kind]:
+                return 0.0
+            if self.synced_at[kind] is None:
+                return None
+            return time.time() - self.synced_at[kind]
+
+    def get(self, kind, namespace, max_age=None):
+        """Return (objects in namespace, age); objects is None when the snapshot is missing or older than max_age."""
+        age = self.get_age(kind)
+        if age is None or (max_age is not None and age > max_age):
+            return None, age
+        with self.lock:
+            objects = [obj for (ns, name), obj in self.objects[kind].items() if ns == namespace]
+        return sorted(objects, key=lambda o: o['metadata']['name']), age
+
+    def __follow(self, kind):
+        while not self.stopped.is_set():
+            try:
+                items, version = self.kube.list_with_version(kind)
+                self.__replace(kind, items)
+                if not hasattr(self.kube, 'watch') or not version:
+                    self.stopped.wait(self.poll_interval)
+                    continue
+                while version and not self.stopped.is_set():
+                    self.__set_live(kind, True)
+                    for event, obj in self.kube.watch(kind, version, timeout=self.watch_timeout):
+                        if event == 'ERROR':
+                            # usually 410 Gone: our resourceVersion is too old, re-list
+                            version = None
+                            break
+                        version = obj['metadata'].get('resourceVersion', version)
+                        self.__apply(kind, event, obj)
+                        if self.stopped.is_set():
+                            break
+            except Exception as e:
+                print "Cluster cache: %s watch failed: %s" % (kind, e)
+                self.stopped.wait(self.retry_interval)
+            finally:
+                self.__set_live(kind, False)
+
+    def __managed(self, obj):
+        return obj['metadata'].get('namespace') in self.namespaces()
+
+    def __replace(self, kind, items):
+        managed = set(self.namespaces())
+        objects = dict(((o['metadata'].get('namespace'), o['metadata']['name']), o)
+                       for o in items if o['metadata'].get('namespace') in managed)
+        with self.lock:
+            self.objects[kind] = objects
+            self.synced_at[kind] = time.time()
+
+    def __apply(self, kind, event, obj):
+        key = (obj['metadata'].get('namespace'), obj['metadata']['name'])
+        managed = self.__managed(obj)
+        with self.lock:
+            if event == 'DELETED' or not managed:
+                self.objects[kind].pop(key, None)
+            else:
+                self.objects[kind][key] = obj
+            self.synced_at[kind] = time.time()
+
+    def __set_live(self, kind, live):
+        with self.lock:
+            if self.live[kind] or live:
+                # the snapshot was current up to the moment the stream opened or closed
+                self.synced_at[kind] = time.time()
+            self.live[kind] = live
@@ -0,0 +1,158 @@
+import inspect
+import json
+import os
+import socket
+import sys
+import threading
+import traceback
+from SocketServer import StreamRequestHandler, ThreadingUnixStreamServer
+
+
+# commands that only read state and may run alongside anything else
+READ_ONLY_PREFIXES = ('get_', 'list_', 'deploy_diff')
+
+# call_* arguments naming environments a command may modify
+ENV_ARGUMENTS = ('env_name', 'env_names', 'dest_env_name')
+
+
+class ThreadLocalStdout(object):
+    """sys.stdout replacement sending each request thread's output to its own client."""
+
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def get_target(self):
+        return getattr(self.local, 'target', None)
+
+    def set_target(self, target):
+        self.local.target = target
+
+    def write(self, data):
+        (getattr(self.local, 'target', None) or self.default).write(data)
+
+    def flush(self):
+        (getattr(self.local, 'target', None) or self.default).flush()
+
+
+class ClientStream(object):
+    """File-like object that forwards writes to the client as {"output": ...} frames."""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        # worker threads of the request write to the same client
+        self.lock = threading.Lock()
+
+    def write(self, data):
+        if data:
+            self.send(output=data)
+
+    def flush(self):
+        pass
+
+    def send(self, **frame):
+        with self.lock:
+            self.wfile.write(json.dumps(frame) + "\n")
+            self.wfile.flush()
+
+
+class RequestHandler(StreamRequestHandler):
+    def handle(self):
+        stream = ClientStream(self.wfile)
+        try:
+            request = json.loads(self.rfile.readline())
+            command = request['command'].replace("-", "_")
+            args = dict((str(k), v) for k, v in request.get('args', {}).items())
+        except (ValueError, KeyError, AttributeError):
+            stream.send(error="Invalid request")
+            return
+        try:
+            self.server.stdout.set_target(stream)
+            result = self.server.run(command, args)
+            if inspect.isgenerator(result):
+                for chunk in result:
+                    stream.write(chunk)
+                result = None
+            stream.send(result=None if result is None else str(result))
+        except socket.error:
+            pass
+        except Exception:
+            stream.send(error=traceback.format_exc())
+        finally:
+            self.server.stdout.set_target(None)
+
+
+class ArtemisDaemon(ThreadingUnixStreamServer):
+    """Serves call_* commands of one long-lived Artemis instance over a Unix socket.
+
+    Commands that may modify an environment are serialized per environment;
+    read-only commands run concurrently.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, tool, socket_path):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        ThreadingUnixStreamServer.__init__(self, socket_path, RequestHandler)
+        os.chmod(socket_path, 0600)
+        self.tool = tool
+        self.socket_path = socket_path
+        self.env_locks = {}
+        self.lock = threading.Lock()
+        self.stdout = ThreadLocalStdout(sys.stdout)
+        sys.stdout = self.stdout
+
+    def server_close(self):
+        ThreadingUnixStreamServer.server_close(self)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def run(self, command, args):
+        method = getattr(self.tool, "call_" + command, None)
+        if method is None:
+            raise ValueError("Command not found: %s" % command.replace("_", "-"))
+        if command.startswith(READ_ONLY_PREFIXES):
+            return method(**args)
+        locks = [self.__env_lock(name) for name in sorted(self.__env_names(args))]
+        for l in locks:
+            l.acquire()
+        try:
+            result = method(**args)
+            # drain generators while holding the locks
+            return "".join(result) if inspect.isgenerator(result) else result
+        finally:
+            for l in reversed(locks):
+                l.release()
+
+    def __env_names(self, args):
+        names = set()
+        for key in ENV_ARGUMENTS:
+            value = args.get(key)
+            if isinstance(value, basestring):
+                names.update(n.strip() for n in value.split(",") if n.strip())
+        return names
+
+    def __env_lock(self, env_name):
+        with self.lock:
+            return self.env_locks.setdefault(env_name, threading.Lock())
+
+
+def call_daemon(socket_path, command, args, out=None):
+    """Forward a command to a running daemon, writing its output to out as it arrives; return the result."""
+    out = out or sys.stdout
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+    try:
+        sock.sendall(json.dumps({'command': command, 'args': args}) + "\n")
+        for line in sock.makefile('r'):
+            frame = json.loads(line)
+            if 'output' in frame:
+                out.write(frame['output'])
+                out.flush()
+            elif 'error' in frame:
+                raise RuntimeError(frame['error'])
+            else:
+                return frame.get('result')
+    finally:
+        sock.close()
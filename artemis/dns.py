@@ -0,0 +1,99 @@
+import socket
+from artemis.metrics import metrics
+
+
+# Route53 accepts at most 1000 changes in a single ChangeBatch
+MAX_BATCH_CHANGES = 1000
+
+
+def record_type(value):
+    """Return 'A' for IPv4 addresses, 'CNAME' for anything else."""
+    try:
+        socket.inet_aton(value)
+        return 'A' if value.count('.') == 3 else 'CNAME'
+    except socket.error:
+        return 'CNAME'
+
+
+class EndpointReconciler(object):
+    """Brings the DNS records below a domain suffix in line with a desired {name: target} map.
+
+    The existing records are read once, compared to the desired ones, and all
+    UPSERT/DELETE changes are submitted together; records that are already
+    correct are left alone.
+    """
+
+    def __init__(self, conn, zone_id, ttl=60):
+        self.conn = conn
+        self.zone_id = zone_id
+        self.ttl = ttl
+
+    def get_existing(self, suffix):
+        """Return {name: record set} for the A and CNAME records below suffix."""
+        existing = {}
+        kwargs = {'HostedZoneId': self.zone_id, 'StartRecordName': suffix}
+        while True:
+            with metrics.time('route53', 'list_resource_record_sets'):
+                page = self.conn.list_resource_record_sets(**kwargs)
+            for record in page['ResourceRecordSets']:
+                if not self.__in_domain(record['Name'], suffix):
+                    # records are listed in reversed-label order, so everything
+                    # below suffix has been seen once we step outside it
+                    return existing
+                if record['Type'] in ('A', 'CNAME') and record['Name'] != suffix:
+                    existing[record['Name']] = record
+            if not page.get('IsTruncated'):
+                return existing
+            kwargs['StartRecordName'] = page['NextRecordName']
+            kwargs['StartRecordType'] = page['NextRecordType']
+
+    def plan(self, desired, existing, keep=()):
+        """Return the changes needed to turn existing into desired.
+
+        Existing records that are not desired are deleted, unless listed in keep.
+        """
+        changes = []
+        for name in sorted(desired.keys()):
+            wanted = self.__record_set(name, desired[name])
+            current = existing.get(name)
+            if current is not None and self.__same(current, wanted):
+                continue
+            if current is not None and current['Type'] != wanted['Type']:
+                changes.append({'Action': 'DELETE', 'ResourceRecordSet': current})
+            changes.append({'Action': 'UPSERT', 'ResourceRecordSet': wanted})
+        for name in sorted(existing.keys()):
+            if name not in desired and name not in keep:
+                changes.append({'Action': 'DELETE', 'ResourceRecordSet': existing[name]})
+        return changes
+
+    def apply(self, changes, comment=None):
+        for i in range(0, len(changes), MAX_BATCH_CHANGES):
+            batch = {'Changes': changes[i:i + MAX_BATCH_CHANGES]}
+            if comment:
+                batch['Comment'] = comment
+            with metrics.time('route53', 'change_resource_record_sets'):
+                self.conn.change_resource_record_sets(HostedZoneId=self.zone_id, ChangeBatch=batch)
+
+    def reconcile(self, suffix, desired, keep=()):
+        """Diff and apply in one go; return the submitted changes."""
+        changes = self.plan(desired, self.get_existing(suffix), keep)
+        if changes:
+            self.apply(changes, comment="artemis: %s" % suffix)
+        return changes
+
+    def __record_set(self, name, target):
+        return {
+            'Name': name,
+            'Type': record_type(target),
+            'TTL': self.ttl,
+            'ResourceRecords': [{'Value': target}],
+        }
+
+    def __same(self, current, wanted):
+        return (current['Type'] == wanted['Type'] and
+                current.get('TTL') == wanted['TTL'] and
+                sorted(r['Value'].rstrip('.') for r in current.get('ResourceRecords', [])) ==
+                sorted(r['Value'].rstrip('.') for r in wanted['ResourceRecords']))
+
+    def __in_domain(self, name, suffix):
+        return name == suffix or name.endswith('.' + suffix)
@@ -0,0 +1,156 @@
+import os
+import signal
+import subprocess
+import sys
+import threading
+
+
+class CommandTimeout(Exception):
+    pass
+
+
+def bind_output():
+    """Return a function that makes the thread calling it print where the current thread prints.
+
+    Under the daemon sys.stdout sends each request thread's output to its own
+    client; threads started for a request must write there too.
+    """
+    stdout = sys.stdout
+    target = stdout.get_target() if hasattr(stdout, 'get_target') else None
+
+    def bind():
+        if target is not None:
+            stdout.set_target(target)
+    return bind
+
+
+class Future(object):
+    """Result of a call running in the background."""
+
+    def __init__(self, description=''):
+        self.description = description
+        self.done = threading.Event()
+        self.value = None
+        self.exc_info = None
+
+    def set_result(self, value):
+        self.value = value
+        self.done.set()
+
+    def set_exception(self, exc_info):
+        self.exc_info = exc_info
+        self.done.set()
+
+    def result(self, timeout=None):
+        """Wait for the call and return its result, re-raising its exception."""
+        if not self.done.wait(timeout):
+            raise CommandTimeout("%s still running after %ss" % (self.description or "Call", timeout))
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.value
+
+
+class Executor(object):
+    """Runs external commands with per-call timeouts under one global concurrency cap.
+
+    Python 2 has no asyncio, so background calls are threads: submit()
+    starts one per call and returns a Future. The cap applies to the
+    external processes themselves, not to the threads waiting on them, so
+    fanned-out calls may themselves run commands without deadlocking.
+    """
+
+    def __init__(self, max_concurrency=8):
+        self.max_concurrency = max_concurrency
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+
+    def call(self, cmd, input=None, timeout=None, cwd=None, env=None, stderr=subprocess.STDOUT):
+        """Run a shell command and return (returncode, stdout, stderr).
+
+        The process group is killed and CommandTimeout raised if it runs
+        longer than timeout seconds.
+        """
+        if hasattr(input, 'read'):
+            input = input.read()
+        with self.slots:
+            p = subprocess.Popen(cmd, shell=True, cwd=cwd, env=env,
+                                 stdin=subprocess.PIPE if input is not None else None,
+                                 stdout=subprocess.PIPE, stderr=stderr,
+                                 preexec_fn=os.setsid)
+            timed_out = []
+            timer = None
+            if timeout:
+                timer = threading.Timer(timeout, self.__kill, (p, timed_out))
+                timer.daemon = True
+                timer.start()
+            try:
+                output, error = p.communicate(input)
+            finally:
+                if timer is not None:
+                    timer.cancel()
+                    timer.join()
+        if timed_out:
+            raise CommandTimeout("%s timed out after %ss" % (self.__program(cmd), timeout))
+        return p.returncode, output, error
+
+    def check_output(self, cmd, input=None, timeout=None, cwd=None, env=None):
+        """Like subprocess.check_output for a shell command, with a timeout and the concurrency cap."""
+        returncode, output, error = self.call(cmd, input, timeout, cwd, env, stderr=None)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd, output)
+        return output
+
+    def submit(self, fn, *args, **kwargs):
+        """Call fn(*args, **kwargs) in a background thread; return its Future."""
+        future = Future(getattr(fn, '__name__', ''))
+        bind = bind_output()
+
+        def run():
+            bind()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception:
+                future.set_exception(sys.exc_info())
+
+        t = threading.Thread(target=run)
+        t.daemon = True
+        t.start()
+        return future
+
+    def gather(self, futures, timeout=None):
+        """Wait for futures; return [(result, exc_info)] in order.
+
+        exc_info is None when the call returned normally, and result is None when it raised.
+        """
+        results = []
+        for f in futures:
+            try:
+                results.append((f.result(timeout), None))
+            except Exception:
+                results.append((None, sys.exc_info()))
+        return results
+
+    def map(self, fn, items, limit=None):
+        """Call fn on every item, at most limit at a time; return [(item, result, exc_info)] in item order."""
+        items = list(items)
+        limiter = threading.BoundedSemaphore(limit) if limit else None
+
+        def call(item):
+            if limiter is None:
+                return fn(item)
+            with limiter:
+                return fn(item)
+
+        futures = [self.submit(call, item) for item in items]
+        return [(item, result, exc_info) for item, (result, exc_info) in zip(items, self.gather(futures))]
+
+    def __program(self, cmd):
+        # the rest of the command line may carry credentials, e.g. terraform -var
+        words = [w for w in cmd.split() if '=' not in w]
+        return os.path.basename(words[0]) if words else 'Command'
+
+    def __kill(self, p, timed_out):
+        timed_out.append(True)
+        try:
+            os.killpg(p.pid, signal.SIGKILL)
+        except OSError:
+            pass
@@ -0,0 +1,90 @@
+import threading
+
+
+def image_branch(image_tag):
+    """Return the branch part of a <branch_name>-<build_number> image tag."""
+    return image_tag.split("-")[0] if image_tag else ''
+
+
+class ImageIndex(object):
+    """Reverse index from image basename and branch to the components using it.
+
+    Built from all environments on first lookup and kept current afterwards
+    through the registry's change notifications, so a lookup costs the same
+    however many environments and components there are. Before each lookup
+    the registry checks one mtime per environment for writes made by other
+    processes (the CLI, the daemon).
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.images = None
+        self.components = {}
+        self.lock = threading.Lock()
+
+    def lookup(self, image_basename, branch=None):
+        """Return sorted (environment name, component name) pairs using an image, optionally on one branch."""
+        if self.images is None:
+            self.rebuild()
+        else:
+            # lets the registry report environments and components changed on disk, also by other processes
+            self.registry.revalidate()
+        with self.lock:
+            branches = self.images.get(image_basename, {})
+            if branch is not None:
+                return sorted(branches.get(branch, ()))
+            return sorted(key for users in branches.values() for key in users)
+
+    def rebuild(self):
+        components = {}
+        for env in self.registry.get_all():
+            for comp in env.get_components(resource_type='kube'):
+                components[(env.get_name(), comp.get_name())] = self.__entry(comp)
+        with self.lock:
+            self.components = {}
+            self.images = {}
+            for key, entry in components.items():
+                self.__set(key, entry)
+
+    def component_changed(self, env, comp):
+        if self.images is None:
+            return
+        entry = self.__entry(comp)
+        with self.lock:
+            self.__set((env.get_name(), comp.get_name()), entry)
+
+    def environment_changed(self, env):
+        if self.images is None:
+            return
+        entries = dict((comp.get_name(), self.__entry(comp)) for comp in env.get_components(resource_type='kube'))
+        with self.lock:
+            self.__remove_environment(env.get_name())
+            for name, entry in entries.items():
+                self.__set((env.get_name(), name), entry)
+
+    def environment_removed(self, env_name):
+        if self.images is None:
+            return
+        with self.lock:
+            self.__remove_environment(env_name)
+
+    def __entry(self, comp):
+        basename = comp.get_image_basename()
+        return (basename, image_branch(comp.get_image_tag())) if basename else None
+
+    def __set(self, key, entry):
+        old = self.components.pop(key, None)
+        if old is not None:
+            users = self.images[old[0]][old[1]]
+            users.discard(key)
+            if not users:
+                del self.images[old[0]][old[1]]
+                if not self.images[old[0]]:
+                    del self.images[old[0]]
+        if entry is not None:
+            self.components[key] = entry
+            self.images.setdefault(entry[0], {}).setdefault(entry[1], set()).add(key)
+
+    def __remove_environment(self, env_name):
+        for key in [k for k in self.components.keys() if k[0] == env_name]:
+            self.__set(key, None)
@@ -0,0 +1,124 @@
+import itertools
+import threading
+import time
+from collections import deque
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job(object):
+    _ids = itertools.count(1)
+
+    def __init__(self, key, description, fn, args, coalesce):
+        self.id = next(self._ids)
+        self.key = key
+        self.description = description
+        self.fn = fn
+        self.args = args
+        self.coalesce = coalesce
+        self.state = 'queued'
+        self.error = None
+        self.queued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def get_duration(self):
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.time()) - self.started_at
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'key': list(self.key),
+            'description': self.description,
+            'state': self.state,
+            'error': self.error,
+            'queued_at': self.queued_at,
+            'waited': (self.started_at or self.finished_at or time.time()) - self.queued_at,
+            'duration': self.get_duration(),
+        }
+
+
+class JobQueue(object):
+    """Fixed-size worker pool that runs at most one job at a time per key.
+
+    Jobs with the same key, e.g. (environment, component), run in submission
+    order. Submitting a coalescing job drops the coalescing jobs still queued
+    for its key, so a burst of image updates only deploys the newest tag.
+    """
+
+    def __init__(self, workers=4, max_pending=100, history=100):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = {}
+        self.ready = deque()
+        self.running = {}
+        self.finished = deque(maxlen=history)
+        self.cond = threading.Condition()
+        self.threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self.__work, name="job-worker-%d" % i)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, key, description, fn, args=(), coalesce=False):
+        with self.cond:
+            queue = self.pending.setdefault(key, deque())
+            if coalesce:
+                for job in [j for j in queue if j.coalesce]:
+                    queue.remove(job)
+                    job.state = 'superseded'
+                    job.finished_at = time.time()
+                    self.finished.append(job)
+            if sum(len(q) for q in self.pending.values()) >= self.max_pending:
+                if not queue:
+                    del self.pending[key]
+                raise QueueFull("%d jobs already queued" % self.max_pending)
+            job = Job(key, description, fn, args, coalesce)
+            queue.append(job)
+            if key not in self.running and key not in self.ready:
+                self.ready.append(key)
+                self.cond.notify()
+            return job
+
+    def get_jobs(self):
+        with self.cond:
+            return {
+                'queued': [j.to_dict() for q in self.pending.values() for j in q],
+                'running': [j.to_dict() for j in self.running.values()],
+                'finished': [j.to_dict() for j in reversed(self.finished)],
+            }
+
+    def __work(self):
+        while True:
+            with self.cond:
+                while not self.ready:
+                    self.cond.wait()
+                key = self.ready.popleft()
+                job = self.pending[key].popleft()
+                if not self.pending[key]:
+                    del self.pending[key]
+                self.running[key] = job
+                job.state = 'running'
+                job.started_at = time.time()
+
+            try:
+                job.fn(*job.args)
+                job.state = 'done'
+            except Exception as e:
+                job.state = 'failed'
+                job.error = str(e)
+
+            with self.cond:
+                job.finished_at = time.time()
+                del self.running[key]
+                self.finished.append(job)
+                if key in self.pending:
+                    self.ready.append(key)
+                    self.cond.notify()
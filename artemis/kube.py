@@ -0,0 +1,228 @@
+import json
+import pipes
+import subprocess
+import time
+from calendar import timegm
+from collections import namedtuple
+from artemis import specio
+from artemis.executor import Executor, CommandTimeout
+from artemis.metrics import metrics
+
+
+# kind -> (API prefix, resource name, namespaced)
+RESOURCES = {
+    'Namespace': ('api/v1', 'namespaces', False),
+    'Pod': ('api/v1', 'pods', True),
+    'Service': ('api/v1', 'services', True),
+    'Endpoints': ('api/v1', 'endpoints', True),
+    'ReplicationController': ('api/v1', 'replicationcontrollers', True),
+    'Secret': ('api/v1', 'secrets', True),
+    'ConfigMap': ('api/v1', 'configmaps', True),
+    'PersistentVolumeClaim': ('api/v1', 'persistentvolumeclaims', True),
+    'Deployment': ('apis/extensions/v1beta1', 'deployments', True),
+}
+
+
+class KubeError(Exception):
+    def __init__(self, message, status=None):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+def resource_info(kind):
+    try:
+        return RESOURCES[kind]
+    except KeyError:
+        raise KubeError("Unsupported resource kind: %s" % kind)
+
+
+def with_namespace(manifest, namespace):
+    """Return manifest with metadata.namespace defaulted to namespace; kinds not in RESOURCES are left unchanged."""
+    if not namespace or not RESOURCES.get(manifest['kind'], (None, None, False))[2]:
+        return manifest
+    if manifest.get('metadata', {}).get('namespace'):
+        return manifest
+    manifest = dict(manifest)
+    manifest['metadata'] = dict(manifest.get('metadata', {}), namespace=namespace)
+    return manifest
+
+
+PodStatus = namedtuple('PodStatus', ['name', 'app', 'status', 'ready', 'restarts', 'start_time', 'uptime'])
+
+
+def pod_status(pod, now=None):
+    """Build a PodStatus record from a Pod API object."""
+    status = pod.get('status', {})
+    containers = status.get('containerStatuses', [])
+    state = status.get('reason') or status.get('phase', 'Unknown')
+    for c in containers:
+        for key in ('waiting', 'terminated'):
+            reason = c.get('state', {}).get(key, {}).get('reason')
+            if reason:
+                state = reason
+    if pod['metadata'].get('deletionTimestamp'):
+        state = 'Terminating'
+    start_time = status.get('startTime')
+    return PodStatus(
+        name=pod['metadata']['name'],
+        app=pod['metadata'].get('labels', {}).get('app', ''),
+        status=state,
+        ready="%d/%d" % (len([c for c in containers if c.get('ready')]), len(pod.get('spec', {}).get('containers', containers))),
+        restarts=sum(c.get('restartCount', 0) for c in containers),
+        start_time=start_time,
+        uptime=format_age(start_time, now) if start_time else '')
+
+
+def format_age(timestamp, now=None):
+    """Format an RFC 3339 UTC timestamp as a kubectl style age, e.g. 5m or 3d."""
+    seconds = int((now or time.time()) - timegm(time.strptime(timestamp, '%Y-%m-%dT%H:%M:%SZ')))
+    for unit, size in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds >= size:
+            return "%d%s" % (seconds / size, unit)
+    return "%ds" % max(seconds, 0)
+
+
+class KubectlClient(object):
+    """Cluster backend that shells out to kubectl_command and parses its JSON output."""
+
+    def __init__(self, kubectl_command, executor=None, timeout=None):
+        self.kubectl_command = kubectl_command
+        self.executor = executor or Executor()
+        self.timeout = timeout
+
+    def run(self, cmd, input=None, timeout=None):
+        with metrics.time('kubectl', 'run'):
+            return self.executor.check_output("%s %s" % (self.kubectl_command, cmd), input=input,
+                                              timeout=timeout or self.timeout)
+
+    def run_async(self, cmd, input=None, timeout=None):
+        """Start run() in the background; return a Future of its output."""
+        return self.executor.submit(self.run, cmd, input, timeout)
+
+    def run_input(self, cmd, data, timeout=None):
+        """Run kubectl with data on stdin; return (returncode, combined output) instead of raising.
+
+        Raises KubeError only if kubectl times out.
+        """
+        with metrics.time('kubectl', cmd.split()[0]):
+            try:
+                returncode, output, error = self.executor.call("%s %s" % (self.kubectl_command, cmd), input=data,
+                                                              timeout=timeout or self.timeout)
+            except CommandTimeout as e:
+                raise KubeError(str(e))
+        return returncode, output
+
+    def list(self, kind, namespace=None, label_selector=None):
+        return self.list_with_version(kind, namespace, label_selector)[0]
+
+    def list_with_version(self, kind, namespace=None, label_selector=None):
+        """Return (items, resourceVersion of the list)."""
+        cmd = "get %s -o json" % resource_info(kind)[1]
+        cmd += " --namespace=%s" % namespace if namespace else " --all-namespaces"
+        if label_selector:
+            cmd += " -l '%s'" % label_selector
+        result = self.__json(cmd)
+        return result.get('items', []), result.get('metadata', {}).get('resourceVersion')
+
+    def get(self, kind, name, namespace=None):
+        return self.__json("get %s %s -o json%s" % (resource_info(kind)[1], name, self.__ns(namespace)))
+
+    def create(self, manifest, namespace=None):
+        manifest = with_namespace(manifest, namespace)
+        # --namespace places kinds kubectl knows but RESOURCES does not
+        returncode, output = self.run_input("create -o json -f -%s" % self.__ns(self.__target_ns(manifest, namespace)),
+                                            json.dumps(manifest))
+        if returncode != 0:
+            raise KubeError(output.strip())
+        return json.loads(output)
+
+    def delete(self, kind, name, namespace=None):
+        # kubectl resolves kinds itself, so any kind it knows can be deleted
+        returncode, output = self.run_input("delete %s %s%s" % (kind.lower(), name, self.__ns(namespace)), "")
+        if returncode != 0:
+            raise KubeError(output.strip())
+
+    def patch(self, kind, name, patch, namespace=None):
+        """Merge-patch an object and return it."""
+        return self.__json("patch %s %s%s --type=merge -o json -p %s" % (
+            resource_info(kind)[1], name, self.__ns(namespace), pipes.quote(json.dumps(patch))))
+
+    def apply_manifests(self, manifests, namespace=None):
+        """Apply manifests in order, one kubectl invocation per run sharing a namespace; return [(kind, name, status)].
+
+        kubectl refuses objects whose namespace differs from --namespace, so
+        manifests naming another namespace are applied separately.
+        """
+        manifests = [with_namespace(m, namespace) for m in manifests]
+        groups = []
+        for m in manifests:
+            target = self.__target_ns(m, namespace)
+            if not groups or groups[-1][0] != target:
+                groups.append((target, []))
+            groups[-1][1].append(m)
+        results = []
+        for target, group in groups:
+            results.extend(self.__apply(group, target))
+        return results
+
+    def __apply(self, manifests, namespace):
+        returncode, output = self.run_input("apply -f -%s" % self.__ns(namespace), specio.dump_all(manifests))
+        results = []
+        lines = output.splitlines()
+        for m in manifests:
+            kind, name = m['kind'], m['metadata']['name']
+            status = 'no result reported'
+            for line in lines:
+                if kind.lower() not in line.lower():
+                    continue
+                if '"%s"' % name not in line and '/%s ' % name not in line:
+                    continue
+                status = 'failed (%s)' % line.strip() if line.startswith('Error') else line.split()[-1]
+                break
+            results.append((kind, name, status))
+        if returncode != 0 and not any(s.startswith('failed') for k, n, s in results):
+            results.append(('kubectl', 'apply', 'failed (exit status %d)' % returncode))
+        return results
+
+    def logs(self, name, namespace=None, tail_lines=None, since_time=None, follow=False, timestamps=False):
+        """Yield the log of a pod line by line as kubectl writes it; kubectl is killed if the generator is closed early."""
+        cmd = "logs %s%s" % (name, self.__ns(namespace))
+        if tail_lines is not None:
+            cmd += " --tail=%d" % int(tail_lines)
+        if since_time:
+            cmd += " --since-time=%s" % pipes.quote(since_time)
+        if follow:
+            cmd += " --follow"
+        if timestamps:
+            cmd += " --timestamps"
+        p = subprocess.Popen(
+            "%s %s" % (self.kubectl_command, cmd), shell=True,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        try:
+            with metrics.time('kubectl', 'logs'):
+                # readline rather than iterating the file, which reads ahead and would stall --follow
+                for line in iter(p.stdout.readline, ''):
+                    yield line
+        finally:
+            if p.poll() is None:
+                p.kill()
+            p.stdout.close()
+            p.wait()
+
+    def __json(self, cmd):
+        with metrics.time('kubectl', cmd.split()[0]):
+            try:
+                returncode, output, error = self.executor.call("%s %s" % (self.kubectl_command, cmd),
+                                                              timeout=self.timeout, stderr=subprocess.PIPE)
+            except CommandTimeout as e:
+                raise KubeError(str(e))
+            if returncode != 0:
+                raise KubeError(error.strip() or output.strip())
+        with metrics.time('json_parse', 'kubectl'):
+            return json.loads(output)
+
+    def __target_ns(self, manifest, namespace):
+        return manifest.get('metadata', {}).get('namespace') or namespace
+
+    def __ns(self, namespace):
+        return " --namespace=%s" % namespace if namespace else ""
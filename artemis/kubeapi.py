@@ -0,0 +1,139 @@
+import json
+import requests
+from requests.adapters import HTTPAdapter
+from artemis.kube import KubeError, with_namespace, resource_info
+from artemis.metrics import metrics
+
+
+class KubeApiClient(object):
+    """Cluster backend that talks to the Kubernetes REST API over a pooled keep-alive session."""
+
+    def __init__(self, server, token=None, ca_file=None, verify=True, pool_size=10, timeout=30):
+        self.server = server.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.verify = ca_file if ca_file else verify
+        if token:
+            self.session.headers['Authorization'] = 'Bearer %s' % token
+
+    def list(self, kind, namespace=None, label_selector=None):
+        return self.list_with_version(kind, namespace, label_selector)[0]
+
+    def list_with_version(self, kind, namespace=None, label_selector=None):
+        """Return (items, resourceVersion of the list)."""
+        params = {'labelSelector': label_selector} if label_selector else {}
+        result = self._request('GET', self._url(kind, namespace), params=params)
+        return result.get('items', []), result.get('metadata', {}).get('resourceVersion')
+
+    def watch(self, kind, resource_version=None, namespace=None, timeout=300):
+        """Yield (event type, object) from a watch stream until the server closes it after timeout seconds."""
+        params = {'watch': 'true', 'timeoutSeconds': timeout}
+        if resource_version:
+            params['resourceVersion'] = resource_version
+        url = self._url(kind, namespace)
+        with metrics.time('kube_api', 'WATCH'):
+            try:
+                r = self.session.get(url, params=params, stream=True, timeout=(self.timeout, timeout + self.timeout))
+            except requests.RequestException as e:
+                raise KubeError("GET %s: %s" % (url, e))
+            try:
+                if r.status_code >= 400:
+                    raise KubeError("GET %s: %s" % (url, r.text), status=r.status_code)
+                for line in r.iter_lines():
+                    if line:
+                        event = json.loads(line)
+                        yield event['type'], event['object']
+            finally:
+                r.close()
+
+    def logs(self, name, namespace=None, tail_lines=None, since_time=None, follow=False, timestamps=False):
+        """Yield the log of a pod line by line from a streamed response; the connection is closed with the generator."""
+        params = {}
+        if tail_lines is not None:
+            params['tailLines'] = int(tail_lines)
+        if since_time:
+            params['sinceTime'] = since_time
+        if follow:
+            params['follow'] = 'true'
+        if timestamps:
+            params['timestamps'] = 'true'
+        url = self._url('Pod', namespace, name) + "/log"
+        with metrics.time('kube_api', 'LOGS'):
+            try:
+                r = self.session.get(url, params=params, stream=True,
+                                     timeout=(self.timeout, None if follow else self.timeout))
+            except requests.RequestException as e:
+                raise KubeError("GET %s: %s" % (url, e))
+            try:
+                if r.status_code >= 400:
+                    raise KubeError("GET %s: %s" % (url, r.text), status=r.status_code)
+                for line in r.iter_lines(chunk_size=4096):
+                    yield line + "\n"
+            finally:
+                r.close()
+
+    def get(self, kind, name, namespace=None):
+        return self._request('GET', self._url(kind, namespace, name))
+
+    def create(self, manifest, namespace=None):
+        manifest = with_namespace(manifest, namespace)
+        return self._request('POST', self._url(manifest['kind'], manifest['metadata'].get('namespace')),
+                             data=json.dumps(manifest),
+                             headers={'Content-Type': 'application/json'})
+
+    def delete(self, kind, name, namespace=None):
+        self._request('DELETE', self._url(kind, namespace, name))
+
+    def patch(self, kind, name, patch, namespace=None, patch_type='application/merge-patch+json'):
+        return self._request('PATCH', self._url(kind, namespace, name),
+                             data=json.dumps(patch),
+                             headers={'Content-Type': patch_type})
+
+    def apply_manifests(self, manifests, namespace=None):
+        """Create each manifest, merge-patching the ones that already exist; return [(kind, name, status)]."""
+        results = []
+        for m in manifests:
+            m = with_namespace(m, namespace)
+            kind, name = m['kind'], m['metadata']['name']
+            try:
+                self.create(m)
+                status = 'created'
+            except KubeError as e:
+                if e.status != 409:
+                    results.append((kind, name, 'failed (%s)' % e))
+                    continue
+                try:
+                    self.patch(kind, name, m, m['metadata'].get('namespace'))
+                    status = 'configured'
+                except KubeError as e:
+                    status = 'failed (%s)' % e
+            results.append((kind, name, status))
+        return results
+
+    def _url(self, kind, namespace=None, name=None):
+        prefix, resource, namespaced = resource_info(kind)
+        url = "%s/%s" % (self.server, prefix)
+        if namespaced and namespace:
+            url += "/namespaces/%s" % namespace
+        url += "/%s" % resource
+        if name:
+            url += "/%s" % name
+        return url
+
+    def _request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        try:
+            with metrics.time('kube_api', method):
+                r = self.session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            raise KubeError("%s %s: %s" % (method, url, e))
+        if r.status_code >= 400:
+            try:
+                message = r.json().get('message', r.text)
+            except ValueError:
+                message = r.text
+            raise KubeError("%s %s: %s" % (method, url, message), status=r.status_code)
+        return r.json() if r.content else {}
@@ -0,0 +1,100 @@
+import re
+import threading
+import time
+from Queue import Queue, Empty, Full
+
+
+TIMESTAMP = re.compile(r'^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.(\d+))?Z ')
+
+# end of a pod's stream
+DONE = object()
+
+
+def split_timestamp(line):
+    """Split a line of `logs --timestamps` output into (sort key, line without timestamp).
+
+    RFC 3339 timestamps from the API drop trailing zeros of the fraction, so
+    the fraction is padded before comparing. Lines without a timestamp
+    (e.g. the continuation of a multi-line message) get the key None.
+    """
+    m = TIMESTAMP.match(line)
+    if m is None:
+        return None, line
+    return m.group(1) + "." + (m.group(2) or "").ljust(9, "0"), line[m.end():]
+
+
+class PodLogReader(threading.Thread):
+    """Reads one pod's log stream into a bounded queue, blocking while the queue is full."""
+
+    def __init__(self, pod_name, lines, queue_size, stopped):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.pod_name = pod_name
+        self.lines = lines
+        self.queue = Queue(queue_size)
+        self.stopped = stopped
+
+    def run(self):
+        try:
+            for line in self.lines:
+                if not self.put(line):
+                    return
+            self.put(DONE)
+        except Exception as e:
+            self.put(e)
+        finally:
+            self.lines.close()
+
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except Full:
+                pass
+        return False
+
+
+def merge_logs(streams, queue_size=100, follow=False, window=1.0):
+    """Merge {pod name: timestamped line generator} into one stream of '[pod] line' ordered by timestamp.
+
+    Every pod is read concurrently into a queue of at most queue_size lines.
+    Without follow the streams are merged exactly. When following, a pod
+    that has nothing to say is waited for at most window seconds before
+    the lines of the other pods are passed on.
+    """
+    stopped = threading.Event()
+    readers = [PodLogReader(name, lines, queue_size, stopped) for name, lines in sorted(streams.items())]
+    for r in readers:
+        r.start()
+    heads = {}
+    last_key = {}
+    try:
+        while readers:
+            waiting = False
+            for r in [r for r in readers if r not in heads]:
+                try:
+                    item = r.queue.get_nowait() if follow else r.queue.get(timeout=1)
+                except Empty:
+                    waiting = True
+                    continue
+                if item is DONE:
+                    readers.remove(r)
+                elif isinstance(item, Exception):
+                    readers.remove(r)
+                    yield "[%s] error reading log: %s\n" % (r.pod_name, item)
+                else:
+                    key, line = split_timestamp(item)
+                    # continuation lines sort with the line before them
+                    key = last_key.get(r) if key is None else key
+                    last_key[r] = key
+                    heads[r] = (key or "", line, time.time())
+            if waiting and (not follow or not heads or time.time() - min(h[2] for h in heads.values()) < window):
+                if follow:
+                    time.sleep(0.05)
+                continue
+            if heads:
+                r = min(heads, key=lambda r: heads[r][0])
+                yield "[%s] %s" % (r.pod_name, heads.pop(r)[1])
+    finally:
+        stopped.set()
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import threading
+from artemis import specio
+
+
+# kept in every environment directory; a dotfile, so it is not listed as a component
+MANIFEST_FILE = '.manifest.json'
+
+# what a component whose file has disappeared reports
+MISSING_ENTRY = {'file': None, 'type': None, 'kind': None, 'image': '', 'image_basename': '',
+                 'image_tag': '', 'hash': None, 'mtime': None, 'size': None}
+
+
+def describe(specs):
+    """Return (kind of the first document, image of the first ReplicationController) of a kube component."""
+    specs = [s for s in specs if isinstance(s, dict)]
+    kind = specs[0].get('kind') if specs else None
+    for spec in specs:
+        if spec.get('kind') == 'ReplicationController':
+            try:
+                return kind, spec['spec']['template']['spec']['containers'][0]['image']
+            except (KeyError, IndexError, TypeError):
+                return kind, ''
+    return kind, ''
+
+
+def encode_strings(obj):
+    # keep entries plain str under Python 2, like the values parsed from YAML
+    return dict((k.encode('utf-8'), v.encode('utf-8') if isinstance(v, unicode) else v) for k, v in obj.items())
+
+
+class ManifestIndex(object):
+    """Per-environment index of component files: kind, type, image, file hash, mtime and size.
+
+    Entries are trusted as long as their file's mtime and size match, so
+    image lookups and diffs need no YAML parsing. The index is written
+    atomically, so readers never see a partial one.
+    """
+
+    def __init__(self, env_dir):
+        self.path = os.path.join(env_dir, MANIFEST_FILE)
+        self.entries = None
+        self.dirty = False
+        self.lock = threading.RLock()
+
+    def get(self, name, file_path, component_type):
+        """Return the entry for a component, re-indexing (and saving) it if its file changed.
+
+        Returns MISSING_ENTRY if the file no longer exists.
+        """
+        with self.lock:
+            entry = self.__load().get(name)
+            if entry is None or not self.__is_current(entry, file_path):
+                try:
+                    with open(file_path, 'r') as f:
+                        entry = self.record(name, file_path, component_type, f.read())
+                except IOError:
+                    self.remove(name)
+                    return MISSING_ENTRY
+                self.save()
+            return entry
+
+    def record(self, name, file_path, component_type, content, specs=None):
+        """Index content just written to file_path; passing its parsed specs saves parsing it again. Call save() afterwards."""
+        kind, image = None, None
+        if component_type == 'kube':
+            if specs is None:
+                specs = specio.load_all(content)
+            kind, image = describe(specs)
+        st = os.stat(file_path)
+        parts = image.split(":") if image else []
+        entry = {
+            'file': os.path.basename(file_path),
+            'type': component_type,
+            'kind': kind,
+            'image': image,
+            'image_basename': parts[0] if parts else '',
+            'image_tag': parts[1] if len(parts) > 1 else '',
+            'hash': hashlib.sha1(content).hexdigest(),
+            'mtime': st.st_mtime,
+            'size': st.st_size,
+        }
+        with self.lock:
+            self.__load()[name] = entry
+            self.dirty = True
+        return entry
+
+    def remove(self, name):
+        with self.lock:
+            if self.__load().pop(name, None) is not None:
+                self.dirty = True
+
+    def refresh(self, components):
+        """Re-index the files of changed (name, file, type) components and drop entries of missing ones.
+
+        Saves once if anything, including earlier record() or remove() calls, changed.
+        """
+        with self.lock:
+            entries = self.__load()
+            names = set()
+            for name, file_path, component_type in components:
+                names.add(name)
+                entry = entries.get(name)
+                if entry is None or not self.__is_current(entry, file_path):
+                    with open(file_path, 'r') as f:
+                        self.record(name, file_path, component_type, f.read())
+            for name in [n for n in entries.keys() if n not in names]:
+                self.remove(name)
+            if self.dirty:
+                self.save()
+
+    def save(self):
+        with self.lock:
+            specio.write_atomic(self.path, json.dumps(self.__load(), sort_keys=True))
+            self.dirty = False
+
+    def __load(self):
+        if self.entries is None:
+            try:
+                with open(self.path, 'r') as f:
+                    self.entries = json.load(f, object_hook=encode_strings)
+            except (IOError, ValueError):
+                self.entries = {}
+        return self.entries
+
+    def __is_current(self, entry, file_path):
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return False
+        return entry.get('mtime') == st.st_mtime and entry.get('size') == st.st_size and \
+            entry.get('file') == os.path.basename(file_path)
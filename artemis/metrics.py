@@ -0,0 +1,170 @@
+import inspect
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                             for k, v in pairs)
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.values = {}
+
+    def inc(self, label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s counter" % self.name]
+        for label_values, value in sorted(self.values.items()):
+            lines.append("%s%s %s" % (self.name, format_labels(self.label_names, label_values), format_value(value)))
+        return lines
+
+
+class Histogram(object):
+    def __init__(self, name, help, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts, sum, count]
+        self.values = {}
+
+    def observe(self, label_values, value):
+        entry = self.values.get(label_values)
+        if entry is None:
+            entry = self.values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][i] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s histogram" % self.name]
+        for label_values, (counts, total, count) in sorted(self.values.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append("%s_bucket%s %d" % (self.name, format_labels(self.label_names, label_values, [('le', bound)]), bucket_count))
+            lines.append("%s_bucket%s %d" % (self.name, format_labels(self.label_names, label_values, [('le', '+Inf')]), count))
+            lines.append("%s_sum%s %s" % (self.name, format_labels(self.label_names, label_values), format_value(total)))
+            lines.append("%s_count%s %d" % (self.name, format_labels(self.label_names, label_values), count))
+        return lines
+
+
+class MetricsRegistry(object):
+    """Latency histograms and error counts of external calls and commands, rendered in Prometheus text format.
+
+    Operations slower than slow_threshold seconds are reported to slow_log,
+    when both are set.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations = Histogram('artemis_operation_duration_seconds',
+                                    'Duration of calls to external tools and services.', ('operation', 'detail'))
+        self.operation_errors = Counter('artemis_operation_errors_total',
+                                        'Calls to external tools and services that raised.', ('operation', 'detail'))
+        self.commands = Histogram('artemis_command_duration_seconds', 'Duration of call_* commands.', ('command',))
+        self.command_errors = Counter('artemis_command_errors_total', 'call_* commands that raised.', ('command',))
+        self.slow_threshold = None
+        self.slow_log = None
+
+    def observe(self, kind, histogram, errors, label_values, seconds, failed=False):
+        with self.lock:
+            histogram.observe(label_values, seconds)
+            if failed:
+                errors.inc(label_values)
+        if self.slow_threshold is not None and self.slow_log is not None and seconds >= self.slow_threshold:
+            self.slow_log("Slow %s %s: %.3fs%s" % (kind, " ".join(str(v) for v in label_values if v),
+                                                   seconds, " (failed)" if failed else ""))
+
+    @contextmanager
+    def time(self, operation, detail=''):
+        """Time the body of a with-statement as one call of an external operation.
+
+        Streams timed from inside a generator are not failed when the consumer closes them early.
+        """
+        start = time.time()
+        failed = False
+        try:
+            yield
+        except GeneratorExit:
+            raise
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.observe('operation', self.operations, self.operation_errors, (operation, detail), time.time() - start, failed)
+
+    def timed_command(self, fn, command):
+        """Wrap a call_* method so its calls are recorded; the original stays reachable as __wrapped__.
+
+        Commands returning a generator are timed until their output is exhausted or closed.
+        """
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException:
+                self.observe('command', self.commands, self.command_errors, (command,), time.time() - start, True)
+                raise
+            if inspect.isgenerator(result):
+                return self.__timed_stream(result, command, start)
+            self.observe('command', self.commands, self.command_errors, (command,), time.time() - start)
+            return result
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        wrapper.__module__ = fn.__module__
+        wrapper.__wrapped__ = fn
+        return wrapper
+
+    def __timed_stream(self, stream, command, start):
+        failed = False
+        try:
+            for chunk in stream:
+                yield chunk
+        except GeneratorExit:
+            raise
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.observe('command', self.commands, self.command_errors, (command,), time.time() - start, failed)
+
+    def render(self):
+        with self.lock:
+            lines = []
+            for metric in (self.operations, self.operation_errors, self.commands, self.command_errors):
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+def instrument_commands(cls):
+    """Class decorator recording every call_* method of cls in metrics.commands."""
+    for name, fn in list(cls.__dict__.items()):
+        if name.startswith('call_') and callable(fn):
+            setattr(cls, name, metrics.timed_command(fn, name[5:].replace("_", "-")))
+    return cls
+
+
+def log_to_stderr(message):
+    sys.stderr.write("%s %s\n" % (time.strftime("%Y-%m-%d %H:%M:%S"), message))
@@ -0,0 +1,79 @@
+import hashlib
+import threading
+
+
+class PromotionMatrix(object):
+    """Image tag differences between environments, for each adjacent pair of stages and any other pair.
+
+    Every environment's component -> image tag map is built once and cached
+    under the combined hash of its kube spec files, as recorded in the
+    environment's manifest index, and only rebuilt after one of them changes.
+    """
+
+    def __init__(self, registry, stages=()):
+        self.registry = registry
+        self.stages = list(stages)
+        self.tags = {}
+        self.lock = threading.Lock()
+
+    def get_tags(self, env_name):
+        """Return {component name: image tag} for an environment, or None if it does not exist."""
+        env = self.registry.get(env_name)
+        if env is None:
+            return None
+        components = env.get_components(resource_type='kube')
+        digest = self.__spec_hash(components)
+        with self.lock:
+            cached = self.tags.get(env_name)
+            if cached is not None and cached[0] == digest:
+                return cached[1]
+        tags = dict((c.get_name(), c.get_image_tag()) for c in components)
+        with self.lock:
+            self.tags[env_name] = (digest, tags)
+        return tags
+
+    def get_stage_pairs(self):
+        return zip(self.stages, self.stages[1:])
+
+    def diff(self, source_env_name, dest_env_name):
+        """Return {component: {'source': tag, 'dest': tag}} for components whose tags differ, or {'error': message}."""
+        return self.__diff(source_env_name, dest_env_name, {})
+
+    def get_matrix(self, pairs=()):
+        """Return [(source, dest, diff)] for every adjacent stage pair followed by pairs, loading each environment once."""
+        loaded = {}
+        result = []
+        for source, dest in self.get_stage_pairs() + [p for p in pairs if p not in self.get_stage_pairs()]:
+            result.append((source, dest, self.__diff(source, dest, loaded)))
+        self.__prune()
+        return result
+
+    def __diff(self, source_env_name, dest_env_name, loaded):
+        for name in (source_env_name, dest_env_name):
+            if name not in loaded:
+                loaded[name] = self.get_tags(name)
+            if loaded[name] is None:
+                return {'error': 'Environment %s does not exist.' % name}
+        source_tags = loaded[source_env_name]
+        dest_tags = loaded[dest_env_name]
+        if sorted(source_tags.keys()) != sorted(dest_tags.keys()):
+            return {'error': 'Different components sets in the source and the destination environments.'}
+        to_update = {}
+        for name in dest_tags.keys():
+            if source_tags[name] != dest_tags[name]:
+                to_update[name] = {'source': source_tags[name], 'dest': dest_tags[name]}
+        if to_update == {}:
+            to_update['error'] = 'Nothing to deploy, the environments are same.'
+        return to_update
+
+    def __spec_hash(self, components):
+        h = hashlib.sha1()
+        for comp in sorted(components, key=lambda c: c.get_name()):
+            h.update("%s\0%s\0" % (comp.get_name(), comp.get_file_hash()))
+        return h.hexdigest()
+
+    def __prune(self):
+        names = set(self.registry.get_names())
+        with self.lock:
+            for name in [n for n in self.tags.keys() if n not in names]:
+                del self.tags[name]
@@ -0,0 +1,100 @@
+import time
+from artemis.kube import KubeError
+
+
+class RolloutTimeout(Exception):
+    pass
+
+
+def wait_for(condition, timeout, initial_interval=1, max_interval=10):
+    """Poll condition with exponential backoff until it returns a true value or timeout seconds pass."""
+    deadline = time.time() + timeout
+    interval = initial_interval
+    while True:
+        result = condition()
+        if result:
+            return result
+        if time.time() >= deadline:
+            raise RolloutTimeout("Timed out after %ds" % timeout)
+        time.sleep(min(interval, max(deadline - time.time(), 0)))
+        interval = min(interval * 2, max_interval)
+
+
+def is_ready(pod):
+    for condition in pod.get('status', {}).get('conditions', []):
+        if condition.get('type') == 'Ready':
+            return condition.get('status') == 'True'
+    return False
+
+
+def pod_images(pod_spec):
+    return [c.get('image') for c in pod_spec.get('containers', [])]
+
+
+class RollingUpdater(object):
+    """Rolls a ReplicationController or Deployment to a new pod template without taking it down.
+
+    Deployments are rolled by the server; for ReplicationControllers the
+    controller is scaled up by one, then old pods are replaced one at a time,
+    each replacement waiting for the new pod to become ready.
+    """
+
+    KINDS = ('ReplicationController', 'Deployment')
+
+    def __init__(self, kube, timeout=600, max_interval=10):
+        self.kube = kube
+        self.timeout = timeout
+        self.max_interval = max_interval
+
+    def update(self, spec, namespace):
+        if spec['kind'] == 'Deployment':
+            return self.__update_deployment(spec, namespace)
+        if spec['kind'] == 'ReplicationController':
+            return self.__update_replication_controller(spec, namespace)
+        raise KubeError("Rolling update not supported for %s" % spec['kind'])
+
+    def __update_deployment(self, spec, namespace):
+        name = spec['metadata']['name']
+        deployment = self.kube.patch('Deployment', name, {'spec': {'template': spec['spec']['template']}}, namespace)
+        generation = deployment.get('metadata', {}).get('generation', 0)
+
+        def rolled_out():
+            d = self.kube.get('Deployment', name, namespace)
+            status = d.get('status', {})
+            replicas = d['spec'].get('replicas', 1)
+            return (status.get('observedGeneration', 0) >= generation and
+                    status.get('updatedReplicas', 0) == replicas and
+                    status.get('availableReplicas', 0) >= replicas)
+
+        self.__wait(rolled_out)
+        print "Rolled out Deployment %s" % name
+
+    def __update_replication_controller(self, spec, namespace):
+        name = spec['metadata']['name']
+        template = spec['spec']['template']
+        images = pod_images(template['spec'])
+        # Kubernetes defaults an omitted selector to the template's labels
+        labels = spec['spec'].get('selector') or template.get('metadata', {}).get('labels', {})
+        selector = ','.join("%s=%s" % item for item in sorted(labels.items()))
+        replicas = self.kube.get('ReplicationController', name, namespace)['spec'].get('replicas', 1)
+
+        def pods():
+            return self.kube.list('Pod', namespace, label_selector=selector)
+
+        def updated_ready(count):
+            return lambda: len([p for p in pods() if is_ready(p) and pod_images(p['spec']) == images]) >= count
+
+        self.kube.patch('ReplicationController', name, {'spec': {'template': template, 'replicas': replicas + 1}}, namespace)
+        try:
+            self.__wait(updated_ready(1))
+            old_pods = [p for p in pods() if pod_images(p['spec']) != images]
+            for i, pod in enumerate(old_pods):
+                self.kube.delete('Pod', pod['metadata']['name'], namespace)
+                self.__wait(updated_ready(min(i + 2, replicas + 1)))
+                print "Rolling update of %s: replaced pod %s (%d/%d)" % (name, pod['metadata']['name'], i + 1, len(old_pods))
+        finally:
+            self.kube.patch('ReplicationController', name, {'spec': {'replicas': replicas}}, namespace)
+        print "Rolled out ReplicationController %s" % name
+
+    def __wait(self, condition):
+        return wait_for(condition, self.timeout, max_interval=self.max_interval)
@@ -0,0 +1,81 @@
+import os
+import threading
+
+
+PLACEHOLDER = "%%ENV_NAME%%"
+
+
+class SkeletonTemplate(object):
+    """All files of one skeleton version, split around the %%ENV_NAME%% placeholder once."""
+
+    def __init__(self, signature, files):
+        self.signature = signature
+        self.files = [(name, content.split(PLACEHOLDER)) for name, content in sorted(files)]
+
+    def get_file_names(self):
+        return [name for name, segments in self.files]
+
+    def render(self, env_name):
+        """Yield (file name, content) for every file with the placeholder substituted."""
+        for name, segments in self.files:
+            yield name, env_name.join(segments)
+
+
+class SkeletonCache(object):
+    """Compiled SkeletonTemplates by version, shared by all environments of that version.
+
+    Versions are read from spec_dir/<version>/ and recompiled when a file
+    there changes, or, with a GitSpecStore, from the version's tree and
+    recompiled only when the tree hash changes.
+    """
+
+    def __init__(self, spec_dir='skeletons', store=None):
+        self.spec_dir = spec_dir
+        self.store = store
+        self.templates = {}
+        self.lock = threading.Lock()
+
+    def has_version(self, version):
+        if self.store is not None:
+            return self.store.get_tree(version) is not None
+        return os.path.isdir(self.get_dir(version))
+
+    def get_dir(self, version):
+        return "%s/%s" % (self.spec_dir, version)
+
+    def get(self, version):
+        if self.store is not None:
+            signature = self.store.get_tree(version)
+        else:
+            signature = self.__signature(self.get_dir(version))
+        with self.lock:
+            template = self.templates.get(version)
+            if template is None or template.signature != signature:
+                template = SkeletonTemplate(signature, self.__read_files(version, signature))
+                self.templates[version] = template
+            return template
+
+    def invalidate(self):
+        with self.lock:
+            self.templates = {}
+
+    def __read_files(self, version, signature):
+        if self.store is not None:
+            return self.store.read_tree(signature)
+        files = []
+        for i in os.listdir(self.get_dir(version)):
+            file_path = os.path.join(self.get_dir(version), i)
+            if os.path.isfile(file_path):
+                with open(file_path, 'r') as f:
+                    files.append((i, f.read()))
+        return files
+
+    def __signature(self, skel_dir):
+        entries = []
+        for i in sorted(os.listdir(skel_dir)):
+            st = os.stat(os.path.join(skel_dir, i))
+            entries.append((i, st.st_mtime, st.st_size))
+        return tuple(entries)
+
+
+skeletons = SkeletonCache()
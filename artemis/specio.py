@@ -0,0 +1,74 @@
+"""Reading and writing YAML specs and other state files.
+
+Uses libyaml's CSafeLoader/CSafeDumper when PyYAML was built with it and
+the pure-Python SafeLoader/SafeDumper otherwise. Files are written to a
+temporary file in the same directory and renamed into place, so a reader
+sees either the old or the new content, never a truncated file.
+"""
+import os
+import tempfile
+import yaml
+from artemis.metrics import metrics
+
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+    LIBYAML = True
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+    LIBYAML = False
+
+
+def load(content):
+    """Parse a single YAML document from a string or file."""
+    with metrics.time('yaml_parse', 'load'):
+        return yaml.load(content, Loader=SafeLoader)
+
+
+def load_all(content):
+    """Parse every document of a multi-document YAML string or file, skipping empty ones."""
+    with metrics.time('yaml_parse', 'load_all'):
+        return [doc for doc in yaml.load_all(content, Loader=SafeLoader) if doc is not None]
+
+
+def dump(spec):
+    return yaml.dump(spec, Dumper=SafeDumper, default_flow_style=False)
+
+
+def dump_all(specs):
+    """Dump specs as one multi-document YAML string."""
+    return yaml.dump_all(specs, Dumper=SafeDumper, default_flow_style=False)
+
+
+def read(path):
+    with open(path, 'r') as f:
+        return load(f)
+
+
+def read_all(path):
+    with open(path, 'r') as f:
+        return load_all(f.read())
+
+
+def write_atomic(path, content):
+    """Replace path with content through a temporary file and a rename."""
+    directory, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=".%s." % name, suffix=".tmp", dir=directory or ".")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        if os.path.exists(path):
+            os.chmod(tmp_path, os.stat(path).st_mode & 0777)
+        else:
+            os.chmod(tmp_path, 0644)
+        os.rename(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_specs(path, specs):
+    """Atomically write specs as a (multi-document, if more than one) YAML file; return the content written."""
+    content = dump(specs[0]) if len(specs) == 1 else dump_all(specs)
+    write_atomic(path, content)
+    return content
@@ -0,0 +1,100 @@
+import os
+import subprocess
+import threading
+import time
+from artemis.metrics import metrics
+
+
+class SpecStoreError(Exception):
+    pass
+
+
+class GitSpecStore(object):
+    """Skeleton versions read straight from the object database of the spec repository.
+
+    The repository is cloned without a checkout and only ever fetched, at most
+    once per fetch_interval seconds. Each <version> directory resolves to a
+    tree hash; file contents are read as blobs, so nothing depends on (or
+    races over) a working tree.
+    """
+
+    def __init__(self, repo_url, repo_dir, ref='origin/HEAD', fetch_interval=60):
+        self.repo_url = repo_url
+        self.repo_dir = repo_dir
+        self.ref = ref
+        self.fetch_interval = fetch_interval
+        self.fetched_at = None
+        self.commit = None
+        self.blobs = {}
+        self.commit_info = {}
+        self.lock = threading.Lock()
+
+    def fetch(self, force=False):
+        """Clone or fetch the spec repository unless it was fetched less than fetch_interval seconds ago."""
+        with self.lock:
+            if not force and self.fetched_at is not None and time.time() - self.fetched_at < self.fetch_interval:
+                return False
+            if os.path.isdir(self.repo_dir):
+                print self.__git('fetch', 'origin')
+            else:
+                with metrics.time('git', 'clone'):
+                    print subprocess.check_output(['git', 'clone', '--no-checkout', self.repo_url, self.repo_dir])
+            self.fetched_at = time.time()
+            self.commit = None
+            return True
+
+    def get_commit(self):
+        with self.lock:
+            if self.commit is None:
+                if not os.path.isdir(self.repo_dir):
+                    raise SpecStoreError("Spec repository %s has not been cloned" % self.repo_dir)
+                self.commit = self.__git('rev-parse', '%s^{commit}' % self.ref).strip()
+            return self.commit
+
+    def get_tree(self, version):
+        """Return the tree hash of a version directory, or None if there is no such version."""
+        try:
+            return self.__git('rev-parse', '--verify', '-q', '%s:%s' % (self.get_commit(), version)).strip() or None
+        except subprocess.CalledProcessError:
+            return None
+
+    def read_tree(self, tree):
+        """Return [(file name, content)] for the files directly in a tree."""
+        entries = []
+        for line in self.__git('ls-tree', tree).splitlines():
+            info, name = line.split("\t", 1)
+            mode, kind, sha = info.split()
+            if kind == 'blob':
+                entries.append((name, sha))
+        self.__read_blobs([sha for name, sha in entries if sha not in self.blobs])
+        return [(name, self.blobs[sha]) for name, sha in sorted(entries)]
+
+    def get_commit_info(self, version):
+        """Return '<author> at <date> <subject>' of the last commit touching a version, memoized per commit."""
+        commit = self.get_commit()
+        key = (commit, version)
+        if key not in self.commit_info:
+            self.commit_info[key] = self.__git('log', '-1', '--format=%an at %ci %s', commit, '--', version)
+        return self.commit_info[key]
+
+    def __read_blobs(self, shas):
+        """Read many blobs with a single 'git cat-file --batch'; blobs never change, so they are kept by hash."""
+        if not shas:
+            return
+        with metrics.time('git', 'cat-file'):
+            p = subprocess.Popen(['git', 'cat-file', '--batch'], cwd=self.repo_dir,
+                                 stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            output = p.communicate("\n".join(shas) + "\n")[0]
+        pos = 0
+        for sha in shas:
+            end = output.index("\n", pos)
+            header = output[pos:end].split()
+            if header[1] == 'missing':
+                raise SpecStoreError("Missing object %s" % sha)
+            size = int(header[2])
+            self.blobs[sha] = output[end + 1:end + 1 + size]
+            pos = end + 1 + size + 1
+
+    def __git(self, *args):
+        with metrics.time('git', args[0]):
+            return subprocess.check_output(('git',) + args, cwd=self.repo_dir)
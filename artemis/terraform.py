@@ -0,0 +1,110 @@
+import hashlib
+import os
+import pipes
+from artemis import specio
+from artemis.executor import Executor, CommandTimeout
+from artemis.metrics import metrics
+
+
+# written to an environment directory after a successful apply
+APPLIED_FILE = '.terraform-applied'
+
+INPUT_EXTENSIONS = ('.tf', '.tfvars')
+
+
+class TerraformError(Exception):
+    def __init__(self, message, output=''):
+        Exception.__init__(self, message)
+        self.output = output
+
+
+class TerraformRunner(object):
+    """Runs terraform_command in environment directories.
+
+    All runs share one plugin cache directory, so providers are downloaded
+    once rather than per environment. After a successful apply the hash of
+    the environment's terraform inputs is recorded, and later applies are
+    skipped until those inputs change.
+    """
+
+    def __init__(self, command='terraform', variables=None, plugin_cache_dir=None, init=True, concurrency=4,
+                 executor=None, timeout=None):
+        self.command = command
+        self.executor = executor or Executor()
+        self.timeout = timeout
+        self.variables = variables or {}
+        self.plugin_cache_dir = os.path.abspath(plugin_cache_dir) if plugin_cache_dir else None
+        self.init = init
+        self.concurrency = concurrency
+
+    def run(self, env_dir, cmd, add_variables=True, timeout=None):
+        """Run one terraform command in env_dir and return its output; raise TerraformError if it fails."""
+        args = "%s %s" % (self.command, cmd)
+        if add_variables:
+            args += "".join(" -var %s" % pipes.quote("%s=%s" % item) for item in sorted(self.variables.items()))
+        with metrics.time('terraform', cmd.split()[0]):
+            try:
+                returncode, output, error = self.executor.call(args, cwd=env_dir, env=self.__environ(),
+                                                              timeout=timeout or self.timeout)
+            except CommandTimeout as e:
+                raise TerraformError("%s in %s" % (e, env_dir))
+            if returncode != 0:
+                raise TerraformError("%s failed in %s with exit code %d" % (cmd.split()[0], env_dir, returncode), output)
+        return output
+
+    def run_async(self, env_dir, cmd, add_variables=True, timeout=None):
+        """Start run() in the background; return a Future of its output."""
+        return self.executor.submit(self.run, env_dir, cmd, add_variables, timeout)
+
+    def inputs_hash(self, env_dir):
+        """Hash of the names and contents of all terraform input files in env_dir, or None if there are none."""
+        parts = []
+        for i in sorted(os.listdir(env_dir)):
+            file_path = os.path.join(env_dir, i)
+            if os.path.splitext(i)[1] in INPUT_EXTENSIONS and os.path.isfile(file_path):
+                with open(file_path, 'rb') as f:
+                    parts.append("%s\0%s\0" % (i, f.read()))
+        return hashlib.sha1("".join(parts)).hexdigest() if parts else None
+
+    def is_applied(self, env_dir):
+        try:
+            with open(os.path.join(env_dir, APPLIED_FILE), 'r') as f:
+                return f.read().strip() == self.inputs_hash(env_dir)
+        except IOError:
+            return False
+
+    def apply(self, env_dir, force=False):
+        """Apply env_dir unless its inputs are unchanged since the last successful apply.
+
+        Returns the terraform output, or None if the apply was skipped.
+        """
+        inputs = self.inputs_hash(env_dir)
+        if inputs is None or (not force and self.is_applied(env_dir)):
+            return None
+        output = ""
+        if self.init:
+            output += self.run(env_dir, "init -input=false", add_variables=False)
+        output += self.run(env_dir, "apply")
+        specio.write_atomic(os.path.join(env_dir, APPLIED_FILE), inputs + "\n")
+        return output
+
+    def destroy(self, env_dir):
+        if os.path.isfile(os.path.join(env_dir, APPLIED_FILE)):
+            os.remove(os.path.join(env_dir, APPLIED_FILE))
+        return self.run(env_dir, "destroy -force")
+
+    def apply_all(self, env_dirs, force=False):
+        """Apply many environment directories, at most concurrency at a time; return [(env_dir, output, exc_info)]."""
+        return self.executor.map(lambda env_dir: self.apply(env_dir, force), env_dirs, self.concurrency)
+
+    def __environ(self):
+        environ = dict(os.environ)
+        if self.plugin_cache_dir:
+            if not os.path.isdir(self.plugin_cache_dir):
+                try:
+                    os.makedirs(self.plugin_cache_dir)
+                except OSError:
+                    # created by a concurrent run
+                    pass
+            environ['TF_PLUGIN_CACHE_DIR'] = self.plugin_cache_dir
+        return environ
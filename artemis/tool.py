@@ -1,28 +1,110 @@
 import sys
 import os
-import yaml
-import subprocess
-import shutil
-import boto3
+import copy
 import inspect
 import socket
-
-
+import threading
+import hashlib
+import json
+from artemis.cache import ClusterStateCache
+from artemis.dns import EndpointReconciler
+from artemis.executor import Executor
+from artemis.images import ImageIndex
+from artemis.logs import merge_logs
+from artemis.manifest import ManifestIndex
+from artemis.metrics import metrics, instrument_commands, log_to_stderr
+from artemis.promotion import PromotionMatrix
+from artemis.rollout import RollingUpdater
+from artemis.skeleton import SkeletonCache, skeletons
+from artemis import specio
+from artemis.specstore import GitSpecStore
+from artemis.terraform import TerraformRunner
+from artemis.kube import KubectlClient, KubeError, pod_status
+
+
+@instrument_commands
 class Artemis(object):
     def __init__(self, config_file='config.yml'):
-        with open(config_file, 'r') as f:
-            self.config = yaml.load(f)
-        self._update_env_list()
-        self.conn = boto3.client('route53',
-                aws_access_key_id=self.config.get('aws_access_key'),
-                aws_secret_access_key=self.config.get('aws_secret_key')
-                )
-        if self.config.get('endpoint_zone', False):
-            for z in self.conn.list_hosted_zones()['HostedZones']:
-                if z['Name'] == self.config.get('endpoint_zone'):
-                    self.endpoint_zone = z['Id']
+        self.config = specio.read(config_file)
+        if self.config.get('spec_use_git', False):
+            self.spec_store = GitSpecStore(self.config.get('spec_repo'), self.config.get('spec_dir'),
+                                           ref=self.config.get('spec_ref', 'origin/HEAD'),
+                                           fetch_interval=self.config.get('spec_fetch_interval', 60))
         else:
-            self.endpoint_zone = False
+            self.spec_store = None
+        self.skeletons = SkeletonCache(self.config.get('spec_dir', 'skeletons'), store=self.spec_store)
+        self.registry = EnvironmentRegistry(skeletons=self.skeletons)
+        self.image_index = ImageIndex(self.registry)
+        self.registry.listeners.append(self.image_index)
+        self.promotion = PromotionMatrix(self.registry, self.config.get('stages', []))
+        self.executor = Executor(self.config.get('max_concurrent_commands', 8))
+        self.kubectl = KubectlClient(self.config.get('kubectl_command'), executor=self.executor,
+                                     timeout=self.config.get('kubectl_timeout'))
+        if self.config.get('kube_api_server', False):
+            from artemis.kubeapi import KubeApiClient
+            self.kube = KubeApiClient(self.config.get('kube_api_server'),
+                                      token=self.config.get('kube_api_token'),
+                                      ca_file=self.config.get('kube_api_ca_file'),
+                                      verify=not self.config.get('kube_api_insecure', False),
+                                      pool_size=self.config.get('kube_api_pool_size', 10))
+        else:
+            self.kube = self.kubectl
+        self.terraform = TerraformRunner(self.config.get('terraform_command', 'terraform'),
+                                         variables={'aws_access_key': self.config.get('aws_access_key'),
+                                                    'aws_secret_key': self.config.get('aws_secret_key')},
+                                         plugin_cache_dir=self.config.get('terraform_plugin_cache',
+                                                                          os.path.join(self.config.get('cache_dir', '.artemis'), 'terraform-plugins')),
+                                         init=self.config.get('terraform_init', True),
+                                         concurrency=self.config.get('terraform_concurrency', 4),
+                                         executor=self.executor,
+                                         timeout=self.config.get('terraform_timeout'))
+        if self.config.get('slow_operation_threshold', False):
+            metrics.slow_threshold = float(self.config.get('slow_operation_threshold'))
+            metrics.slow_log = self.__log
+        self.cluster_cache = None
+        self._conn = None
+        self._endpoint_zone = None
+
+    @property
+    def conn(self):
+        """Route53 client, created (and boto3 imported) on first use."""
+        if self._conn is None:
+            import boto3
+            self._conn = boto3.client('route53',
+                    aws_access_key_id=self.config.get('aws_access_key'),
+                    aws_secret_access_key=self.config.get('aws_secret_key')
+                    )
+        return self._conn
+
+    @property
+    def endpoint_zone(self):
+        """Hosted zone ID of endpoint_zone, or False; resolved on first use and cached on disk."""
+        if self._endpoint_zone is None:
+            self._endpoint_zone = self.__resolve_endpoint_zone()
+        return self._endpoint_zone
+
+    def __resolve_endpoint_zone(self):
+        zone_name = self.config.get('endpoint_zone', False)
+        if not zone_name:
+            return False
+        cache_file = os.path.join(self.config.get('cache_dir', '.artemis'), 'hosted_zones.json')
+        try:
+            with open(cache_file, 'r') as f:
+                zones = json.load(f)
+        except (IOError, ValueError):
+            zones = {}
+        if zone_name not in zones:
+            with metrics.time('route53', 'list_hosted_zones'):
+                hosted_zones = self.conn.list_hosted_zones()['HostedZones']
+            for z in hosted_zones:
+                zones[z['Name']] = z['Id']
+            if zone_name not in zones:
+                print "Hosted zone %s not found" % zone_name
+                return False
+            if not os.path.isdir(os.path.dirname(cache_file)):
+                os.makedirs(os.path.dirname(cache_file))
+            specio.write_atomic(cache_file, json.dumps(zones))
+        return zones[zone_name]
 
     def valid_ip(self, address):
         try:
@@ -32,24 +114,23 @@ class Artemis(object):
             return False
 
     def get_environments(self):
-        return self.environments
+        return self.registry.get_all()
 
     def get_environment(self, name):
-        for e in self.get_environments():
-            if e.get_name() == name:
-                return e
+        return self.registry.get(name)
 
     def get_callable_methods(self):
-        for name, data in inspect.getmembers(self):
+        # look the methods up on the class, getmembers(self) would evaluate the lazy properties
+        for name, data in inspect.getmembers(self.__class__, inspect.ismethod):
             if name[:5] == 'call_':
                 yield (name[5:].replace("_", "-"),
-                       [a.replace("_", "-") for a in inspect.getargspec(data).args if a is not 'self'],
+                       [a.replace("_", "-") for a in inspect.getargspec(getattr(data, '__wrapped__', data)).args if a is not 'self'],
                        data.__doc__)
 
     def call_list_environments(self):
         """Return a list of environments."""
 
-        return self.environments
+        return self.get_environments()
 
     def call_list_components(self, env_name):
         """Return a list of components in an environment."""
@@ -66,24 +147,75 @@ class Artemis(object):
         if self.config.get('spec_use_git', False):
             self._update_env_specs()
 
-        if not os.path.isdir("%s/%s" % (self.config.get('spec_dir'), version)):
+        if not self.skeletons.has_version(version):
             print "Version %s does not exist" % version
             return
         print "Creating environment %s, version %s" % (env_name, version)
-        env = Environment(env_name, version)
-        self.environments.append(env)
-        self._update_env_list()
+        env = Environment(env_name, version, self.skeletons)
+        self.registry.add(env)
+
+    def call_create_environments(self, env_names, version):
+        """Create several environments of one version, e.g. --env-names=pr-1,pr-2,pr-3."""
+        env_names = as_list(env_names)
+
+        if self.config.get('spec_use_git', False):
+            self._update_env_specs()
 
-    def call_provision_terraform(self, env_name):
-        """Call terraform apply on the environment."""
+        if not self.skeletons.has_version(version):
+            print "Version %s does not exist" % version
+            return
+
+        created = []
+        for env_name in env_names:
+            if os.path.isdir("environments/" + env_name):
+                print "Environment %s exists already" % env_name
+                continue
+            self.registry.add(Environment(env_name, version, self.skeletons))
+            created.append(env_name)
+        print "Created %d environments, version %s" % (len(created), version)
+        return created
+
+    def call_provision_terraform(self, env_name, force=False):
+        """Call terraform apply on the environment, unless its terraform files are unchanged since the last apply."""
         env = self.get_environment(env_name)
         if self.config.get('terraform_command', False):
-            print self._terraform(env, "apply")
+            output = self.terraform.apply(env.get_env_dir(), force=as_bool(force))
+            if output is not None:
+                print output
+            elif self.terraform.inputs_hash(env.get_env_dir()) is None:
+                print "No terraform files in %s" % env.get_name()
+            else:
+                print "Terraform files unchanged since last apply"
+
+    def call_provision_terraform_all(self, env_names, force=False):
+        """Call terraform apply on several environments in parallel, skipping unchanged ones, e.g. --env-names=pr-1,pr-2."""
+        env_names = as_list(env_names)
+        if not self.config.get('terraform_command', False):
+            return
+        envs = [self.get_environment(name) for name in env_names]
+        failed = []
+        results = self.terraform.apply_all([env.get_env_dir() for env in envs], force=as_bool(force))
+        for env, (env_dir, output, exc_info) in zip(envs, results):
+            if exc_info is not None:
+                print "Terraform apply failed for %s: %s" % (env.get_name(), exc_info[1])
+                print getattr(exc_info[1], 'output', '')
+                failed.append(env.get_name())
+            elif output is None and self.terraform.inputs_hash(env.get_env_dir()) is None:
+                print "No terraform files in %s" % env.get_name()
+            elif output is None:
+                print "Terraform files of %s unchanged since last apply" % env.get_name()
+            else:
+                print "Applied %s" % env.get_name()
+                print output
+        if failed:
+            return "Failed to apply: %s" % ", ".join(failed)
 
     def call_provision_kubernetes(self, env_name):
         """Create Kubernetes components according to environment specification."""
         env = self.get_environment(env_name)
-        if self.config.get('kubectl_command', False):
+        if self._kube_enabled() and self.config.get('kube_batch_provision', True):
+            self.__provision_kubernetes_batch(env)
+        elif self.config.get('kubectl_command', False):
             print self._kubectl("create namespace %s" % env.get_name())
             print self._kubectl("label namespace %s env_version=%s" % (env.get_name(), env.get_version()))
 
@@ -95,40 +227,143 @@ class Artemis(object):
                     print "Provisioning kubernetes component %s" % c.get_name()
                     print self._kubectl("create -f -", input=open(c.get_file(), 'r'))
 
+    def __provision_kubernetes_batch(self, env):
+        """Create the namespace, run kubeinit, then submit all kube components as one multi-document stream."""
+        namespace = {
+            'apiVersion': 'v1',
+            'kind': 'Namespace',
+            'metadata': {
+                'name': env.get_name(),
+                'labels': {'env_version': env.get_version()}
+            }
+        }
+        for kind, name, status in self.kube.apply_manifests([namespace]):
+            print "%s %s: %s" % (kind, name, status)
+
+        # kubeinit usually creates secrets and pull credentials the pods need, so it runs before any component
+        for cmd in self.config.get('kubeinit', []):
+            if cmd.strip():
+                print self._kubectl("--namespace %s %s" % (env.get_name(), cmd))
+
+        manifests = [spec for c in env.get_components(resource_type='kube') for spec in c.get_specs()]
+        print "Provisioning %d kubernetes resources in %s" % (len(manifests), env.get_name())
+        if manifests:
+            for kind, name, status in self.kube.apply_manifests(manifests, namespace=env.get_name()):
+                print "%s %s: %s" % (kind, name, status)
+
     def call_provision_environment(self, env_name):
         """Do initial provisioning of an environment in Kubernetes and Terraform."""
         self.call_provision_terraform(env_name)
         self.call_provision_kubernetes(env_name)
 
+    def call_provision_environments(self, env_names, force=False):
+        """Provision several environments, running their terraform applies in parallel, e.g. --env-names=pr-1,pr-2."""
+        env_names = as_list(env_names)
+        result = self.call_provision_terraform_all(env_names, force)
+        for env_name in env_names:
+            self.call_provision_kubernetes(env_name)
+        return result
+
     def call_recreate_component(self, env_name, component_name):
         """Delete and (re-)create and component in an environment."""
         comp = self.get_environment(env_name).get_component(component_name)
+        for spec in comp.get_specs():
+            namespace = spec['metadata'].get('namespace', env_name)
+            try:
+                self.kube.delete(spec['kind'], spec['metadata']['name'], namespace)
+                print "Deleted %s %s" % (spec['kind'], spec['metadata']['name'])
+            except KubeError:
+                pass
+            self.kube.create(spec, namespace)
+            print "Created %s %s" % (spec['kind'], spec['metadata']['name'])
 
-        try:
-            print self._kubectl("delete -f -", input=open(comp.get_file(), 'r'))
-        except:
-            pass
-        print self._kubectl("create -f -", input=open(comp.get_file(), 'r'))
-
-    def call_refresh_environment(self, env_name):
-        """Refresh the environment specification for the specified environment."""
+    def call_refresh_environment(self, env_name, apply=False):
+        """Refresh the environment specification for the specified environment, optionally applying changed components."""
         env = self.get_environment(env_name)
         self._update_env_specs()
-        env.refresh_spec()
+        changes = env.refresh_spec()
+        for kind in ('added', 'changed', 'removed'):
+            if getattr(changes, kind):
+                print "Components %s: %s" % (kind, ", ".join(getattr(changes, kind)))
+        if changes.is_empty():
+            print "Environment spec is up to date"
+        elif as_bool(apply) and self._kube_enabled():
+            self.__apply_spec_changes(env, changes)
         return self.call_get_spec_version(env_name)
 
+    def __apply_spec_changes(self, env, changes):
+        """Re-apply only the kube components touched by a spec refresh."""
+        rolling = self.config.get('update_strategy', 'rolling') == 'rolling'
+        manifests = []
+        for name in changes.added + changes.changed:
+            comp = env.get_component(name)
+            if comp is None or comp.get_type() != 'kube':
+                continue
+            for spec in comp.get_specs():
+                if name in changes.changed and rolling and spec['kind'] in RollingUpdater.KINDS:
+                    # applying would only change the template, roll the pods too
+                    RollingUpdater(self.kube, timeout=self.config.get('rollout_timeout', 600)).update(
+                        spec, spec['metadata'].get('namespace', env.get_name()))
+                else:
+                    manifests.append(spec)
+        if manifests:
+            for kind, name, status in self.kube.apply_manifests(manifests, namespace=env.get_name()):
+                print "%s %s: %s" % (kind, name, status)
+        for spec in [s for specs in changes.removed_specs.values() for s in specs]:
+            try:
+                self.kube.delete(spec['kind'], spec['metadata']['name'], spec['metadata'].get('namespace', env.get_name()))
+                print "Deleted %s %s" % (spec['kind'], spec['metadata']['name'])
+            except KubeError as e:
+                print "Failed to delete %s %s: %s" % (spec['kind'], spec['metadata']['name'], e)
+
     def call_teardown_environment(self, env_name):
         """Delete environment resources from Kubernetes and Terraform."""
-        env = self.get_environment(env_name)
-        if self.config.get('kubectl_command', False):
-            try:
-                print self._kubectl("delete namespace %s" % env.get_name())
-            except:
-                pass
-        if self.config.get('terraform_command', False):
-            print self._terraform(env, "destroy -force")
+        for line in self.__teardown(self.get_environment(env_name)):
+            print line
+
+    def call_teardown_environments(self, env_names):
+        """Tear down several environments concurrently, e.g. --env-names=pr-1,pr-2."""
+        env_names = as_list(env_names)
+        envs = [self.get_environment(name) for name in env_names]
+        futures = [self.executor.submit(self.__teardown, env) for env in envs]
+        for env, (lines, error) in zip(envs, self.executor.gather(futures)):
+            if error is not None:
+                print "Failed to tear down %s: %s" % (env.get_name(), error[1])
+                continue
+            for line in lines:
+                print line
 
-        self.call_remove_endpoints(env.name)
+    def __teardown(self, env):
+        """Delete the namespace, destroy terraform resources and remove endpoints concurrently; return output lines.
+
+        Runs in executor threads, so it returns what to print instead of printing.
+        """
+        steps = []
+        if self._kube_enabled():
+            steps.append(('namespace', self.executor.submit(self.__delete_namespace, env)))
+        if self.config.get('terraform_command', False):
+            steps.append(('terraform', self.executor.submit(self.terraform.destroy, env.get_env_dir())))
+        if self.endpoint_zone:
+            steps.append(('endpoints', self.executor.submit(self.__endpoint_reconciler().reconcile,
+                                                            self.__env_fqdn(env), {})))
+        lines = []
+        for (step, _), (result, error) in zip(steps, self.executor.gather([f for _, f in steps])):
+            if error is not None:
+                lines.append("Failed to tear down %s of %s: %s" % (step, env.get_name(), error[1]))
+            elif step == 'namespace' and result:
+                lines.append("Deleted namespace %s" % env.get_name())
+            elif step == 'terraform':
+                lines.append(result)
+            elif step == 'endpoints':
+                lines.extend(self.__endpoint_change_lines(result))
+        return lines
+
+    def __delete_namespace(self, env):
+        try:
+            self.kube.delete('Namespace', env.get_name())
+            return True
+        except KubeError:
+            return False
 
     def call_get_image_tag(self, env_name, component_name):
         """Return the image tag for a specified component."""
@@ -147,7 +382,14 @@ class Artemis(object):
         env = self.get_environment(env_name)
         comp = env.get_component(component_name)
         comp.set_image_tag(image_tag)
-        self.call_recreate_component(env_name, component_name)
+        # only the controllers carry the image; the component's other documents are unchanged
+        controllers = [s for s in comp.get_specs() if s['kind'] in RollingUpdater.KINDS]
+        if self.config.get('update_strategy', 'rolling') == 'rolling' and controllers:
+            updater = RollingUpdater(self.kube, timeout=self.config.get('rollout_timeout', 600))
+            for spec in controllers:
+                updater.update(spec, spec['metadata'].get('namespace', env_name))
+        else:
+            self.call_recreate_component(env_name, component_name)
 
     def call_update_endpoints(self, env_name):
         """Update (or create) DNS endpoints for an environment."""
@@ -155,171 +397,185 @@ class Artemis(object):
             return False
 
         env = self.get_environment(env_name)
-        existing_endpoints = self.__call_get_existing_endpoints(env_name)
+        desired = {}
+        pending = []
 
-        for c in env.get_components(resource_type='kube'):
-            spec = c.get_spec()
-            if spec['kind'] != 'Service':
-                continue
-            try:
-                if spec['spec']['type'] != 'LoadBalancer':
-                    continue
-            except:
+        reconciler = self.__endpoint_reconciler()
+        # the service listing and the Route53 listing do not depend on each other
+        ingresses_future = self.executor.submit(self.get_loadbalancer_ingresses, env.get_name())
+        existing_future = self.executor.submit(reconciler.get_existing, self.__env_fqdn(env))
+        try:
+            ingresses = ingresses_future.result()
+        except KubeError as e:
+            print "Failed to list services in %s: %s" % (env.get_name(), e)
+            return False
+
+        for service_name, elb in ingresses.items():
+            endpoint = "%s.%s.%s" % (service_name, env.get_name(), self.config.get('endpoint_zone'))
+            if elb:
+                desired[endpoint] = elb
+            else:
+                # no ingress yet, leave any existing record alone
+                pending.append(endpoint)
+
+        try:
+            changes = reconciler.plan(desired, existing_future.result(), keep=pending)
+            if changes:
+                reconciler.apply(changes, comment="artemis: %s" % self.__env_fqdn(env))
+        except Exception as e:
+            print "Failed to update endpoints for %s: %s" % (env.get_name(), e)
+            return False
+        self.__print_endpoint_changes(changes)
+        for endpoint in set(desired.keys()) - set(c['ResourceRecordSet']['Name'] for c in changes):
+            print "Endpoint up to date: %s" % endpoint
+
+    def get_loadbalancer_ingresses(self, namespace):
+        """Return {service name: ingress IP or hostname} for every LoadBalancer service in a namespace.
+
+        Services whose load balancer has not been provisioned yet map to ''.
+        """
+        ingresses = {}
+        for svc in self.kube.list('Service', namespace):
+            if svc.get('spec', {}).get('type') != 'LoadBalancer':
                 continue
-            elb = self._kubectl("--namespace=%s describe svc %s|grep Ingress|awk '{print $3}'" % (env.get_name(), spec['metadata']['name']))
-            endpoint = "%s.%s.%s" % (spec['metadata']['name'], env.get_name(), self.config.get('endpoint_zone'))
-           
-            if self.valid_ip(elb):
-                try:
-                    self.__update_dns_record(endpoint, elb)
-                    print "Updated endpoint: %s" % endpoint
-                except:
-                    print "Failed to create endpoint: %s" % endpoint
+            target = ''
+            for ingress in svc.get('status', {}).get('loadBalancer', {}).get('ingress', []):
+                target = ingress.get('ip') or ingress.get('hostname') or ''
+                if target:
+                    break
+            ingresses[svc['metadata']['name']] = target
+        return ingresses
+
+    def find_image_users(self, image_basename, branch=None):
+        """Return (environment name, component name) pairs whose image matches basename and, optionally, branch."""
+        return self.image_index.lookup(image_basename, branch)
+
+    def get_pod_statuses(self, env_name):
+        """Return a PodStatus record for every pod in an environment."""
+        return [pod_status(p) for p in self.kube.list('Pod', env_name)]
+
+    def get_pod_snapshot(self, env_name):
+        """Return (pod statuses, snapshot age in seconds).
+
+        Served from the cluster cache when it is running and not older than
+        cluster_cache_max_age; otherwise the cluster is queried directly and
+        the age is None.
+        """
+        if self.cluster_cache is not None:
+            pods, age = self.cluster_cache.get('Pod', env_name, max_age=self.config.get('cluster_cache_max_age', 30))
+            if pods is not None:
+                return [pod_status(p) for p in pods], age
+        return self.get_pod_statuses(env_name), None
+
+    def start_cluster_cache(self):
+        """Start following pods and services of all environments in the background."""
+        if self.cluster_cache is None:
+            self.cluster_cache = ClusterStateCache(self.kube, self.registry.get_names,
+                                                   poll_interval=self.config.get('cluster_cache_poll_interval', 10))
+            self.cluster_cache.start()
+        return self.cluster_cache
 
     def call_remove_endpoints(self, env_name):
         """Delete DNS endpoints for an environment."""
         if not self.endpoint_zone:
             return False
         env = self.get_environment(env_name)
-        existing_endpoints = self.__call_get_existing_endpoints(env_name)
-
-        for record in existing_endpoints.keys():
-            self.__delete_dns_record(record, existing_endpoints[record])
-
-    def __call_get_existing_endpoints(self, env_name):
-        """Return the list of configured DNS records."""
-        env = self.get_environment(env_name)
-        env_fqdn = "%s.%s" % (env.get_name(), self.config.get('endpoint_zone'))
-        existing_endpoints = {}
-        records = self.conn.list_resource_record_sets(HostedZoneId=self.endpoint_zone)
-        for record in records['ResourceRecordSets']:
-            if record['Type'] =='A':
-                if env_fqdn in record['Name']:
-                    existing_endpoints[record['Name']] = record['ResourceRecords'][0]['Value']
-        return existing_endpoints
+        self.__print_endpoint_changes(self.__endpoint_reconciler().reconcile(self.__env_fqdn(env), {}))
 
     def call_list_endpoints(self, env_name):
         """Return a list of DNS endpoints for an environment."""
         if not self.endpoint_zone:
             return False
         env = self.get_environment(env_name)
-        env_fqdn = "%s.%s" % (env.get_name(), self.config.get('endpoint_zone'))
-        endpoints = self.__call_get_existing_endpoints(env_name)
-
-        for endpoint_name in endpoints.keys():
-            if env_fqdn in endpoint_name:
-                print "Endpoint: %s" % endpoint_name
-
-    def call_get_logs(self, env_name, component_name=None, pod_name=None):
-        """Return logs for a pod in a component."""
+        endpoints = self.__endpoint_reconciler().get_existing(self.__env_fqdn(env))
+
+        for endpoint_name in sorted(endpoints.keys()):
+            print "Endpoint: %s" % endpoint_name
+
+    def __endpoint_reconciler(self):
+        return EndpointReconciler(self.conn, self.endpoint_zone)
+
+    def __env_fqdn(self, env):
+        return "%s.%s" % (env.get_name(), self.config.get('endpoint_zone'))
+
+    def __print_endpoint_changes(self, changes):
+        for line in self.__endpoint_change_lines(changes):
+            print line
+
+    def __endpoint_change_lines(self, changes):
+        lines = []
+        for change in changes:
+            record = change['ResourceRecordSet']
+            if change['Action'] == 'DELETE':
+                lines.append("Removed endpoint: %s (%s)" % (record['Name'], record['Type']))
+            else:
+                lines.append("Updated endpoint: %s (%s %s)" % (record['Name'], record['Type'],
+                                                              record['ResourceRecords'][0]['Value']))
+        return lines
+
+    def call_get_logs(self, env_name, component_name=None, pod_name=None, tail_lines=None, since_time=None, follow=False):
+        """Stream logs for a pod, or all pods of a component merged by timestamp; optionally only the last --tail-lines, since --since-time (RFC 3339), or following."""
         if not component_name and not pod_name:
             return "Need to specify either component name or pod name."
+        follow = as_bool(follow)
         if pod_name:
-            return self._kubectl("--namespace=%s logs %s" % (env_name, pod_name))
-        pods = self._kubectl("--namespace=%s get po -l app=%s | awk '{print $1}'" % (env_name, component_name)).split("\n")[1:-1]
-        if len(pods) == 1:
-            return self._kubectl("--namespace=%s logs %s" % (env_name, pods[0]))
+            return self.kube.logs(pod_name, env_name, tail_lines=tail_lines, since_time=since_time, follow=follow)
+        pods = [str(p['metadata']['name']) for p in self.kube.list('Pod', env_name, label_selector="app=%s" % component_name)]
         if len(pods) < 1:
             return "No pods found for component %s in %s" % (component_name, env_name)
-        return "Component %s has %d pods, please specify explicitly with --pod-name\nPods: %s" % (component_name, len(pods), ", ".join(pods))
+        if len(pods) == 1:
+            return self.kube.logs(pods[0], env_name, tail_lines=tail_lines, since_time=since_time, follow=follow)
+        return merge_logs(dict((pod, self.kube.logs(pod, env_name, tail_lines=tail_lines, since_time=since_time,
+                                                     follow=follow, timestamps=True))
+                               for pod in pods),
+                          queue_size=self.config.get('log_queue_size', 100), follow=follow)
+
+    def call_get_metrics(self):
+        """Return operation and command timings in Prometheus text format."""
+        return metrics.render()
 
     def call_get_spec_version(self, env_name):
         """Returns the specification version of a running environment."""
         env = self.get_environment(env_name)
         if self.config.get('spec_use_git', False):
-            return env.get_version() + ": " + subprocess.check_output("cd %s && git --no-pager log -1 --format='%%an at %%ci %%s'" % self.config.get('spec_dir'), shell=True)
+            return env.get_version() + ": " + self.spec_store.get_commit_info(env.get_version())
         return env.get_version()
 
     def call_deploy_diff(self, source_env_name, dest_env_name):
         """Show components which are different between source and destination environments."""
-        source_tags = {}
-        dest_tags = {}
-        to_update = {}
-        s_env = self.get_environment(source_env_name)
-        d_env = self.get_environment(dest_env_name)
-        s_names = []
-        d_names = []
-        s_components = s_env.get_components(resource_type='kube')
-        d_components = d_env.get_components(resource_type='kube')
-        for component in s_components:
-            s_names.append(component.get_name())
-        for component in d_components:
-            d_names.append(component.get_name())
-        if sorted(s_names) == sorted(d_names):
-            for component in s_components:
-                source_tags[component.get_name()] = component.get_image_tag()
-            for component in d_components:
-                dest_tags[component.get_name()] = component.get_image_tag()
-            for name in dest_tags.keys():
-                if source_tags[name] != dest_tags[name]:
-                    to_update[name] = {'source': source_tags[name], 'dest': dest_tags[name]}
-            if to_update == {}:
-                to_update['error'] = 'Nothing to deploy, the environments are same.'
-        else:
-            to_update['error'] = 'Different components sets in the source and the destination environments.'
-        return to_update
+        return self.promotion.diff(source_env_name, dest_env_name)
+
+    def call_get_promotion_matrix(self, pairs=None):
+        """Show tag differences between adjacent stages, plus optional extra pairs, e.g. --pairs=int:prd,pr-1:int."""
+        extra = []
+        if pairs:
+            extra = [tuple(p.strip().split(":", 1)) for p in pairs.split(",") if ":" in p]
+        lines = []
+        for source, dest, diff in self.promotion.get_matrix(extra):
+            lines.append("%s -> %s:" % (source, dest))
+            if 'error' in diff:
+                lines.append("\t%s" % diff['error'])
+            for name in sorted(k for k in diff.keys() if k != 'error'):
+                lines.append("\t%s: %s -> %s" % (name, diff[name]['dest'], diff[name]['source']))
+        return "\n".join(lines)
 
     def call_deploy_from_to(self, source_env_name, dest_env_name):
         """Deploy components where tags are different between environments"""
         to_update = self.call_deploy_diff(source_env_name, dest_env_name)
-        for component in to_update.keys():
-            self.call_update_component(dest_env_name, component, to_update[component]['source'])
+        if 'error' in to_update:
+            return to_update['error']
 
-    def __update_dns_record(self, endpoint, ip_address):
-        """Update DNS record for an endpoint"""
-        self.conn.change_resource_record_sets(
-            HostedZoneId=self.endpoint_zone,
-            ChangeBatch={
-                'Changes': [
-                    {
-                        'Action': 'UPSERT',
-                        'ResourceRecordSet':
-                            {
-                                'Name': endpoint,
-                                'Type': 'A',
-                                'TTL': 60,
-                                'ResourceRecords': [
-                                    {
-                                        'Value': ip_address
-                                    },
-                                ],
-                            }
-                        },
-                    ]
-                }
-            )
-
-    def __delete_dns_record(self, endpoint, ip_address):
-        """Delete DNS record for an endpoint"""
-        self.conn.change_resource_record_sets(
-            HostedZoneId=self.endpoint_zone,
-            ChangeBatch={
-                'Changes': [
-                    {
-                        'Action': 'DELETE',
-                        'ResourceRecordSet': {
-                            'Name': endpoint,
-                            'Type': 'A',
-                            'TTL': 60,
-                            'ResourceRecords': [
-                                {
-                                    'Value': ip_address
-                                },
-                            ],
-                        }
-                    },
-                ]
-            }
-        )
-
-    def __get_environment_list(self):
-        env_list = []
+        def update(component):
+            self.call_update_component(dest_env_name, component, to_update[component]['source'])
 
-        for i in os.listdir("environments/"):
-            if not os.path.isdir("environments/" + i):
-                continue
-            env_list.append(Environment(i, self.__read_env_version(i)))
-        return env_list
+        failed = []
+        for component, result, exc_info in self.executor.map(update, sorted(to_update.keys()),
+                                                             self.config.get('deploy_concurrency', 4)):
+            if exc_info is not None:
+                print "Failed to update %s: %s" % (component, exc_info[1])
+                failed.append(component)
+        if failed:
+            return "Failed to update: %s" % ", ".join(failed)
 
     def __get_kube_environment_list(self):
         return [{'name': env.split(" ")[0], 'version': env.split(" ")[1]}
@@ -333,50 +589,204 @@ class Artemis(object):
     def _get_config(self, key):
         return self.config.get(key, False)
 
-    def __read_env_version(self, env_name):
-        with open("environments/" + env_name + "/VERSION", 'r') as f:
-            return f.readline()
+    def _kubectl(self, cmd, input=None, timeout=None):
+        return self.kubectl.run(cmd, input=input, timeout=timeout)
+
+    def _kubectl_async(self, cmd, input=None, timeout=None):
+        return self.kubectl.run_async(cmd, input=input, timeout=timeout)
+
+    def _kube_enabled(self):
+        return bool(self.config.get('kubectl_command', False) or self.config.get('kube_api_server', False))
 
-    def _kubectl(self, cmd, input=None):
-        return subprocess.check_output(
-            "%s %s" %
-            (self.config.get('kubectl_command'), cmd), shell=True, stdin=input)
+    def _terraform(self, env, cmd, add_credentials=True, timeout=None):
+        return self.terraform.run(env.get_env_dir(), cmd, add_variables=add_credentials, timeout=timeout)
 
-    def _terraform(self, env, cmd, add_credentials=True):
-        return subprocess.check_output("cd %s && %s %s %s" % (
-                                       env.get_env_dir(),
-                                       self.config.get('terraform_command', 'terraform'),
-                                       cmd,
-                                       "-var 'aws_access_key=" + self.config.get('aws_access_key') + "' -var 'aws_secret_key=" + self.config.get('aws_secret_key') + "' " if add_credentials else ""),
-                                       shell=True)
+    def _terraform_async(self, env, cmd, add_credentials=True, timeout=None):
+        return self.terraform.run_async(env.get_env_dir(), cmd, add_variables=add_credentials, timeout=timeout)
 
     def _update_env_specs(self):
         if not self.config.get('spec_use_git', False):
             return
 
-        if os.path.isdir("%s/" % self.config.get('spec_dir')):
-            print subprocess.check_output("cd %s && git pull" % self.config.get('spec_dir'), shell=True)
-        else:
-            print subprocess.check_output("git clone %s %s" % (self.config.get('spec_repo'), self.config.get('spec_dir')), shell=True)
-
-    def _update_env_list(self):
-        self.environments = self.__get_environment_list()
+        with metrics.time('spec_fetch'):
+            self.spec_store.fetch()
 
     def __log(self, message):
         if self.config.get('log_stdout', False):
-            print log_message
+            print message
+        else:
+            log_to_stderr(message)
+
+
+def as_bool(value):
+    """Interpret a CLI/UI argument ('--flag', 'true', 'false', ...) as a boolean."""
+    if isinstance(value, basestring):
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+def as_list(value):
+    """Interpret a comma separated CLI/UI argument ('pr-1,pr-2') as a list; lists are returned as they are."""
+    if isinstance(value, basestring):
+        return [v.strip() for v in value.split(",") if v.strip()]
+    return value
+
+
+def content_hash(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+def is_skeleton_file(file_path):
+    """Whether a file in an environment directory can have come from a skeleton.
+
+    Anything else, such as the terraform.tfstate files terraform writes next
+    to the .tf files, is never removed by a refresh.
+    """
+    name = os.path.basename(file_path)
+    return os.path.splitext(name)[1] in ('.yaml', '.tf') and '.tfstate' not in name
+
+
+def file_hash(file_path):
+    with open(file_path, 'rb') as f:
+        return content_hash(f.read())
+
+
+class SpecChanges(object):
+    """Component names added, changed and removed by a spec refresh, and the documents of removed kube components."""
+
+    def __init__(self):
+        self.added = []
+        self.changed = []
+        self.removed = []
+        self.removed_specs = {}
+
+    def is_empty(self):
+        return not (self.added or self.changed or self.removed)
+
+    def __repr__(self):
+        return "SpecChanges(added=%r, changed=%r, removed=%r)" % (self.added, self.changed, self.removed)
+
+
+class EnvironmentRegistry(object):
+    """Index of the environments under environments/, loaded lazily by name.
+
+    Only the directory listing is kept up to date (by watching the mtime of
+    the environments directory); an Environment is built the first time it
+    is asked for.
+
+    Listeners are told about changes through component_changed(env, comp),
+    environment_changed(env) and environment_removed(name).
+
+    A directory without a VERSION file is an environment still being created
+    (by this or another process); it is kept pending, and only listed and
+    reported once its VERSION has been written.
+    """
+
+    def __init__(self, env_dir="environments", skeletons=skeletons):
+        self.env_dir = env_dir
+        self.skeletons = skeletons
+        self.environments = {}
+        self.pending = set()
+        self.dir_mtime = None
+        self.listeners = []
+        self.lock = threading.RLock()
+
+    def get(self, name):
+        self.__sync()
+        with self.lock:
+            if name not in self.environments:
+                return None
+            if self.environments[name] is None:
+                try:
+                    env = Environment(name, self.__read_env_version(name), self.skeletons)
+                except IOError:
+                    # removed or recreated under us; wait for its VERSION again
+                    del self.environments[name]
+                    self.pending.add(name)
+                    return None
+                env.listeners = self.listeners
+                self.environments[name] = env
+            return self.environments[name]
+
+    def get_names(self):
+        self.__sync()
+        with self.lock:
+            return sorted(self.environments.keys())
+
+    def get_all(self):
+        return [e for e in (self.get(name) for name in self.get_names()) if e is not None]
+
+    def revalidate(self):
+        """Pick up environments, and components of loaded environments, changed on disk by other processes."""
+        self.__sync()
+        with self.lock:
+            loaded = [e for e in self.environments.values() if e is not None]
+        for env in loaded:
+            if env.is_stale():
+                env.reload()
+
+    def add(self, env):
+        self.__sync()
+        with self.lock:
+            env.listeners = self.listeners
+            self.pending.discard(env.get_name())
+            self.environments[env.get_name()] = env
+        for l in self.listeners:
+            l.environment_changed(env)
+
+    def __sync(self):
+        # listeners are called outside the lock, they may call back into the registry
+        with self.lock:
+            added, removed = self.__refresh_index()
+        for name in removed:
+            for l in self.listeners:
+                l.environment_removed(name)
+        for name in added:
+            env = self.get(name)
+            if env is not None:
+                for l in self.listeners:
+                    l.environment_changed(env)
+
+    def __refresh_index(self):
+        mtime = os.stat(self.env_dir).st_mtime
+        first_scan = self.dir_mtime is None
+        removed = []
+        if mtime != self.dir_mtime:
+            names = set(i for i in os.listdir(self.env_dir)
+                        if os.path.isdir(os.path.join(self.env_dir, i)))
+            removed = [name for name in self.environments.keys() if name not in names]
+            for name in removed:
+                del self.environments[name]
+            self.pending = set(name for name in self.pending if name in names)
+            self.pending.update(name for name in names if name not in self.environments)
+            self.dir_mtime = mtime
+        # writing VERSION does not touch the mtime of env_dir, so pending names are checked every time
+        added = []
+        for name in list(self.pending):
+            if os.path.isfile(os.path.join(self.env_dir, name, "VERSION")):
+                self.pending.discard(name)
+                self.environments[name] = None
+                added.append(name)
+        return ([] if first_scan else added), removed
+
+    def __read_env_version(self, env_name):
+        with open(os.path.join(self.env_dir, env_name, "VERSION"), 'r') as f:
+            return f.readline()
 
 
 class Environment(object):
-    def __init__(self, name, version):
+    def __init__(self, name, version, skeletons=skeletons):
         self.name = name
         self.version = version.strip()
-        self.components = []
+        self.skeletons = skeletons
+        self.components = None
+        self.component_index = {}
+        self.dir_mtime = None
+        self.listeners = []
+        self.manifest = ManifestIndex(self.get_env_dir())
 
         if not os.path.isdir(self.get_env_dir()):
             self.__make_spec()
-        else:
-            self.__read_spec()
 
     def get_name(self):
         return self.name
@@ -385,89 +795,173 @@ class Environment(object):
         return self.version
 
     def get_component(self, name):
-        for c in self.components:
-            if c.get_name() == name:
-                return c
+        self.__load_components()
+        return self.component_index.get(name)
 
     def is_auto_deployed(self):
         file_path = os.path.join(self.get_env_dir(), 'AUTO')
         return os.path.isfile(file_path)
 
     def refresh_spec(self):
-        self.__make_spec()
+        """Bring the environment directory in line with its skeleton, rewriting only files that differ.
+
+        Image tags of kube components are preserved as long as the image
+        itself is unchanged. Returns the SpecChanges.
+        """
+        print "Refreshing environment spec from %s" % self.get_skel_dir()
+        self.__load_components()
+        changes = SpecChanges()
+
+        template = self.skeletons.get(self.version)
+        skel_files = template.get_file_names()
+
+        for i, content in template.render(self.name):
+            env_file_path = os.path.join(self.get_env_dir(), i)
+            name = self.__component_name(env_file_path)
+            current = self.component_index.get(name)
+            if current is not None and current.get_type() == 'kube':
+                content = self.__preserve_image_tag(current, content)
+
+            if os.path.isfile(env_file_path):
+                if file_hash(env_file_path) == content_hash(content):
+                    continue
+                changes.changed.append(name)
+            else:
+                changes.added.append(name)
+            specio.write_atomic(env_file_path, content)
+            self.manifest.record(name, env_file_path, self.__component_type(env_file_path), content)
+
+        for c in list(self.components):
+            if os.path.basename(c.get_file()) in skel_files or not is_skeleton_file(c.get_file()):
+                continue
+            changes.removed.append(c.get_name())
+            if c.get_type() == 'kube':
+                changes.removed_specs[c.get_name()] = c.get_specs()
+            os.remove(c.get_file())
+            self.manifest.remove(c.get_name())
+
+        if self.__read_env_file_version() != self.version:
+            specio.write_atomic(os.path.join(self.get_env_dir(), "VERSION"), self.version + "\n")
+
+        self.__read_spec()
+        for l in self.listeners:
+            l.environment_changed(self)
+        return changes
+
+    def is_stale(self):
+        """Whether files were written, added or removed in the environment directory since its components were read.
+
+        Every spec write is a rename into the directory, so this catches writes by other processes too.
+        """
+        if self.components is None:
+            return False
+        try:
+            return os.stat(self.get_env_dir()).st_mtime != self.dir_mtime
+        except OSError:
+            return False
+
+    def reload(self):
+        """Re-read the component list and tell the listeners."""
+        self.__read_spec()
+        for l in self.listeners:
+            l.environment_changed(self)
+
+    def component_changed(self, comp):
+        for l in self.listeners:
+            l.component_changed(self, comp)
 
     def get_components(self, resource_type=''):
+        self.__load_components()
         if not resource_type:
             return self.components
         else:
             return [c for c in self.components if c.get_type() == resource_type]
 
     def __make_spec(self):
-        preserved_component_images = []
-        is_auto = False
-
-        if os.path.isdir("environments/" + self.name):
-            # we are refreshing the environment specs
-            print "Refreshing environment spec from %s" % self.get_skel_dir()
-            if self.is_auto_deployed:
-                is_auto = True
-
-            for c in self.get_components(resource_type='kube'):
-                if c.get_image_basename():
-                    preserved_component_images.append({
-                        'name': c.get_name(),
-                        'image': c.get_image_basename(),
-                        'image_tag': c.get_image_tag()
-                        })
-            shutil.rmtree(self.get_env_dir())
-        else:
-            print "Copying environment spec from %s" % self.get_skel_dir()
+        print "Copying environment spec from %s" % self.get_skel_dir()
 
+        self.components = []
+        self.component_index = {}
         os.mkdir(self.get_env_dir())
 
-        for i in os.listdir(self.get_skel_dir()):
-            file_path = os.path.join(self.get_skel_dir(), i)
-            if not os.path.isfile(file_path):
-                continue
+        for i, content in self.skeletons.get(self.version).render(self.name):
             env_file_path = os.path.join(self.get_env_dir(), i)
-            with open(file_path, 'r') as s, open(env_file_path, 'w') as t:
-                for line in s:
-                    t.write(line.replace("%%ENV_NAME%%", self.name))
+            specio.write_atomic(env_file_path, content)
 
             comp = self.__gen_component(env_file_path)
-            self.components.append(comp)
-
-        with open(os.path.join(self.get_env_dir(), "VERSION"), 'w') as f:
-            f.write(self.version + "\n")
-
-        if is_auto:
-            open(os.path.join(self.get_env_dir(), "AUTO"), 'w').close()
+            self.manifest.record(comp.get_name(), env_file_path, comp.get_type(), content)
+            self.__add_component(comp)
+        self.manifest.save()
+
+        specio.write_atomic(os.path.join(self.get_env_dir(), "VERSION"), self.version + "\n")
+
+    def __preserve_image_tag(self, current, content):
+        """Return content with the image tag of the current component carried over, if its image is unchanged."""
+        specs = specio.load_all(content)
+        controllers = [s for s in specs if isinstance(s, dict) and s.get('kind') == 'ReplicationController']
+        if not controllers or not current.get_image_basename():
+            return content
+        spec = controllers[0]
+        try:
+            image = spec['spec']['template']['spec']['containers'][0]['image']
+        except (KeyError, IndexError, TypeError):
+            return content
+        image_name = image.split(":")[0]
+        if image_name != current.get_image_basename():
+            print "Not preserving image tag for %s, as image has changed (new: %s)" % (current.get_name(), image_name)
+            return content
+        if not current.get_image_tag() or image == image_name + ":" + current.get_image_tag():
+            return content
+        spec['spec']['template']['spec']['containers'][0]['image'] = image_name + ":" + current.get_image_tag()
+        return specio.dump(specs[0]) if len(specs) == 1 else specio.dump_all(specs)
+
+    def __read_env_file_version(self):
+        try:
+            with open(os.path.join(self.get_env_dir(), "VERSION"), 'r') as f:
+                return f.readline().strip()
+        except IOError:
+            return None
 
-        for p in preserved_component_images:
-            c = self.get_component(p['name'])
-            if c.get_image_basename() != p['image']:
-                print "Not preserving image tag for %s, as image has changed (new: %s)" % (c.get_name(), c.get_image_basename())
-                continue
-            print "Preserved %s image tag as %s" % (c.get_name(), p['image_tag'])
-            c.set_image_tag(p['image_tag'])
+    def __load_components(self):
+        if self.components is None:
+            self.__read_spec()
 
     def __read_spec(self):
+        # keep existing Component objects (and their parsed specs) for files still present
+        existing = self.component_index
+        self.components = []
+        self.component_index = {}
+        # taken before listing, so a write racing the listing makes the environment stale again
+        self.dir_mtime = os.stat(self.get_env_dir()).st_mtime
         for i in os.listdir(self.get_env_dir()):
             file_path = os.path.join(self.get_env_dir(), i)
-            if not os.path.isfile(file_path) or i == 'VERSION' or i == 'AUTO':
+            if not os.path.isfile(file_path) or i == 'VERSION' or i == 'AUTO' or i.startswith('.'):
                 continue
-            self.components.append(self.__gen_component(file_path))
+            comp = existing.get(self.__component_name(file_path))
+            self.__add_component(comp if comp is not None and comp.get_file() == file_path
+                                 else self.__gen_component(file_path))
+        self.manifest.refresh([(c.get_name(), c.get_file(), c.get_type()) for c in self.components])
+
+    def __add_component(self, comp):
+        self.components.append(comp)
+        self.component_index[comp.get_name()] = comp
+
+    def __component_name(self, file_path):
+        file_name = os.path.splitext(file_path)[0]
+        return file_name.split("/")[-1] if '/' in file_name else file_name
+
+    def __component_type(self, file_path):
+        return 'kube' if os.path.splitext(file_path)[1] == '.yaml' else 'tf'
 
     def __gen_component(self, file_path):
-        file_name, file_extension = os.path.splitext(file_path)
         return Component(
-            name=file_name.split("/")[-1] if '/' in file_name else file_name,
+            name=self.__component_name(file_path),
             file=file_path,
-            component_type='kube' if file_extension == '.yaml' else 'tf',
+            component_type=self.__component_type(file_path),
             env=self)
 
     def get_skel_dir(self):
-        return "%s/%s" % ("skeletons", self.version)
+        return self.skeletons.get_dir(self.version)
 
     def get_env_dir(self):
         return "environments/%s" % self.name
@@ -480,11 +974,17 @@ class Environment(object):
 
 
 class Component(object):
+    """One spec file of an environment; kind and image are answered from the environment's manifest index."""
+
+    __slots__ = ('name', 'file', 'type', 'env', '_spec', '_spec_key')
+
     def __init__(self, name, file, component_type, env):
         self.name = name
         self.file = file
         self.type = component_type
         self.env = env
+        self._spec = None
+        self._spec_key = None
 
     def get_name(self):
         return self.name
@@ -495,57 +995,75 @@ class Component(object):
     def get_file(self):
         return self.file
 
+    def get_file_hash(self):
+        return self.__entry()['hash']
+
+    def get_kind(self):
+        return self.__entry()['kind'] if self.type == 'kube' else None
+
     def get_spec(self):
-        return self.__read_spec() if self.type == 'kube' else ''
+        """Return the (first) document of a kube component."""
+        if self.type != 'kube':
+            return ''
+        specs = self.__read_specs()
+        return specs[0] if specs else None
+
+    def get_specs(self):
+        """Return all documents of a kube component."""
+        return self.__read_specs() if self.type == 'kube' else []
 
     def set_spec(self, spec):
         if self.type != 'kube':
             return
-        self.__write_spec(spec)
+        self.__write_specs([spec])
 
     def get_image_tag(self):
-        try:
-            return self.get_image_name().split(":")[1]
-        except:
-            return ""
+        return self.__entry()['image_tag'] if self.type == 'kube' else ""
 
     def get_image_basename(self):
-        try:
-            return self.get_image_name().split(":")[0]
-        except:
-            return ""
+        return self.__entry()['image_basename'] if self.type == 'kube' else ""
 
     def get_image_name(self):
         if self.type != 'kube':
             return
-        spec = self.__read_spec()
-        if spec['kind'] != 'ReplicationController':
-            return ""
-
-        try:
-            return spec['spec']['template']['spec']['containers'][0]['image']
-        except:
-            return ""
+        return self.__entry()['image']
 
     def set_image_tag(self, new_tag):
         if self.type != 'kube':
             return
         if new_tag == '':
             raise ValueError
-        spec = self.__read_spec()
-        if spec['kind'] != 'ReplicationController':
+        specs = copy.deepcopy(self.__read_specs())
+        controllers = [s for s in specs if s.get('kind') == 'ReplicationController']
+        if not controllers:
             return
+        spec = controllers[0]
         image_name, image_tag = spec['spec']['template']['spec']['containers'][0]['image'].split(":")
         spec['spec']['template']['spec']['containers'][0]['image'] = image_name + ":" + new_tag
-        self.__write_spec(spec)
-
-    def __read_spec(self):
-        with open(self.file, 'r') as f:
-            return yaml.load(f)
-
-    def __write_spec(self, spec):
-        with open(self.file, 'w') as f:
-            f.write(yaml.dump(spec))
+        self.__write_specs(specs)
+
+    def __read_specs(self):
+        """Return the parsed documents, re-reading the file only if it changed on disk."""
+        key = self.__stat_key()
+        if self._spec is None or key != self._spec_key:
+            self._spec = specio.read_all(self.file)
+            self._spec_key = key
+        return self._spec
+
+    def __write_specs(self, specs):
+        content = specio.write_specs(self.file, specs)
+        self._spec = specs
+        self._spec_key = self.__stat_key()
+        self.env.manifest.record(self.name, self.file, self.type, content, specs=specs)
+        self.env.manifest.save()
+        self.env.component_changed(self)
+
+    def __entry(self):
+        return self.env.manifest.get(self.name, self.file, self.type)
+
+    def __stat_key(self):
+        st = os.stat(self.file)
+        return (st.st_mtime, st.st_size)
 
     def __repr__(self):
         return self.__str__()
@@ -0,0 +1,219 @@
+"""Time artemis' hot paths against a synthetic environments/ tree and stubbed kubectl/terraform.
+
+    python benchmarks/run.py --envs=200 --components=20 --kubectl-latency=0.05 --output=results.json
+    python benchmarks/run.py --baseline=results.json
+
+Results are written as JSON (seconds per run: min, median, mean, max);
+with --baseline, each case is also printed relative to an earlier run.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import yaml
+
+
+COMPONENT = """apiVersion: v1
+kind: ReplicationController
+metadata:
+  name: comp-%(i)03d
+  namespace: "%%%%ENV_NAME%%%%"
+spec:
+  replicas: 1
+  selector:
+    app: comp-%(i)03d
+  template:
+    metadata:
+      labels:
+        app: comp-%(i)03d
+    spec:
+      containers:
+        - name: main
+          image: bench/comp-%(i)03d:master-1
+          ports:
+            - containerPort: 8080
+"""
+
+
+class NullOutput(object):
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+
+def make_tree(work_dir, envs, components, kubectl_latency, terraform_latency):
+    """Write skeletons, environments and a config.yml using the stubs into work_dir."""
+    skel_dir = os.path.join(work_dir, 'skeletons', '1.0')
+    os.makedirs(skel_dir)
+    for i in range(components):
+        with open(os.path.join(skel_dir, 'comp-%03d.yaml' % i), 'w') as f:
+            f.write(COMPONENT % {'i': i})
+
+    for e in range(envs):
+        name = 'env-%04d' % e
+        env_dir = os.path.join(work_dir, 'environments', name)
+        os.makedirs(env_dir)
+        for i in range(components):
+            content = (COMPONENT % {'i': i}).replace('%%ENV_NAME%%', name)
+            # every other environment is one build behind, so deploy diffs have work to do
+            if e % 2 and i % 3 == 0:
+                content = content.replace(':master-1', ':master-0')
+            with open(os.path.join(env_dir, 'comp-%03d.yaml' % i), 'w') as f:
+                f.write(content)
+        with open(os.path.join(env_dir, 'main.tf'), 'w') as f:
+            f.write('variable "env_name" { default = "%s" }\n' % name)
+        with open(os.path.join(env_dir, 'VERSION'), 'w') as f:
+            f.write("1.0\n")
+
+    # the UI looks its templates up relative to the working directory
+    os.symlink(os.path.join(ROOT, 'templates'), os.path.join(work_dir, 'templates'))
+
+    stub = "%s %s" % (sys.executable, os.path.join(ROOT, 'benchmarks', 'stub.py'))
+    config = {
+        'kubectl_command': "BENCH_LATENCY=%s BENCH_COMPONENTS=%d %s kubectl" % (kubectl_latency, components, stub),
+        'terraform_command': "BENCH_LATENCY=%s %s terraform" % (terraform_latency, stub),
+        'terraform_init': False,
+        'kubeinit': [''],
+        'spec_use_git': False,
+        'spec_dir': 'skeletons',
+        'aws_access_key': '',
+        'aws_secret_key': '',
+        'endpoint_zone': '',
+        'stages': ['env-0000', 'env-0001', 'env-0002'],
+    }
+    with open(os.path.join(work_dir, 'config.yml'), 'w') as f:
+        yaml.safe_dump(config, f, default_flow_style=False)
+
+
+def measure(fn, repeat):
+    """Run fn repeat times; return per-run statistics in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        fn()
+        times.append(time.time() - start)
+    times.sort()
+    return {
+        'runs': repeat,
+        'min': times[0],
+        'median': times[len(times) / 2],
+        'mean': sum(times) / len(times),
+        'max': times[-1],
+    }
+
+
+def run_cases(args):
+    from artemis.tool import Artemis
+
+    env_names = ['env-%04d' % e for e in range(args.envs)]
+    source, dest = env_names[0], env_names[1 % len(env_names)]
+    results = {}
+    stdout = sys.stdout
+
+    def case(name, fn):
+        sys.stdout = NullOutput()
+        try:
+            results[name] = measure(fn, args.repeat)
+        finally:
+            sys.stdout = stdout
+        print "%-32s median %8.2fms  max %8.2fms" % (name, results[name]['median'] * 1000, results[name]['max'] * 1000)
+
+    case('construct', lambda: Artemis())
+
+    def get_environment_cold():
+        env = Artemis().get_environment(env_names[-1])
+        env.get_components()[0].get_image_tag()
+    case('get_environment_cold', get_environment_cold)
+
+    # a new process answering "which images run where" from the on-disk tree
+    case('image_index_rebuild_cold', lambda: Artemis().image_index.rebuild())
+
+    tool = Artemis()
+    case('get_environment', lambda: tool.get_environment(env_names[-1]).get_components()[0].get_image_tag())
+    case('call_deploy_diff', lambda: tool.call_deploy_diff(source, dest))
+    case('call_provision_kubernetes', lambda: tool.call_provision_kubernetes(source))
+    case('call_provision_terraform_all', lambda: tool.call_provision_terraform_all(env_names[:10], force=True))
+    case('call_teardown_environments', lambda: tool.call_teardown_environments(env_names[:10]))
+
+    import ui
+    client = ui.ui.test_client()
+    case('ui.new_image_version', lambda: client.get('/newimage/bench/comp-000/master/2'))
+    case('ui.show_environment', lambda: client.get('/env/%s' % source))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, stderr=subprocess.STDOUT).strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+def compare(results, baseline_file):
+    with open(baseline_file, 'r') as f:
+        baseline = json.load(f)['results']
+    print "\nRelative to %s (median):" % baseline_file
+    for name in sorted(results.keys()):
+        if name in baseline and baseline[name]['median'] > 0:
+            print "%-32s %6.2fx" % (name, results[name]['median'] / baseline[name]['median'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--envs', type=int, default=100)
+    parser.add_argument('--components', type=int, default=20)
+    parser.add_argument('--kubectl-latency', type=float, default=0.0, help="seconds per stubbed kubectl call")
+    parser.add_argument('--terraform-latency', type=float, default=0.0, help="seconds per stubbed terraform call")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--baseline', help="earlier results file to compare against")
+    parser.add_argument('--keep', action='store_true', help="keep the synthetic tree")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='artemis-bench-')
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+    cwd = os.getcwd()
+    try:
+        make_tree(work_dir, args.envs, args.components, args.kubectl_latency, args.terraform_latency)
+        # artemis resolves config.yml, environments/ and the spec dir relative to the working directory
+        os.chdir(work_dir)
+        results = run_cases(args)
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print "Synthetic tree kept in %s" % work_dir
+        else:
+            shutil.rmtree(work_dir)
+
+    with open(output, 'w') as f:
+        json.dump({
+            'parameters': {
+                'envs': args.envs,
+                'components': args.components,
+                'kubectl_latency': args.kubectl_latency,
+                'terraform_latency': args.terraform_latency,
+                'repeat': args.repeat,
+            },
+            'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'results': results,
+        }, f, indent=2, sort_keys=True)
+    print "Results written to %s" % output
+    if baseline:
+        compare(results, baseline)
+
+
+if __name__ == '__main__':
+    main()
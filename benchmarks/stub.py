@@ -0,0 +1,62 @@
+"""Stand-in for kubectl and terraform in benchmarks.
+
+Usage: stub.py kubectl|terraform <arguments>
+
+Sleeps BENCH_LATENCY seconds (set per tool in the command line the
+harness configures), then answers just enough of the kubectl
+commands artemis issues to keep it going: pods are synthesized for
+BENCH_COMPONENTS components named comp-000, comp-001, ...
+"""
+import json
+import os
+import re
+import sys
+import time
+
+
+def namespace(args):
+    for a in args:
+        if a.startswith('--namespace='):
+            return a.split('=', 1)[1]
+    return 'default'
+
+
+def pods(ns, components):
+    now = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() - 3600))
+    return [{
+        'metadata': {'name': 'comp-%03d-%s' % (i, 'x1y2z'), 'namespace': ns, 'labels': {'app': 'comp-%03d' % i}},
+        'spec': {'containers': [{'name': 'main'}]},
+        'status': {'phase': 'Running', 'startTime': now,
+                   'containerStatuses': [{'ready': True, 'restartCount': 0, 'state': {'running': {}}}]}
+    } for i in range(components)]
+
+
+def kubectl(args):
+    if 'get' in args and '-o' in args:
+        if 'pods' in args:
+            items = pods(namespace(args), int(os.environ.get('BENCH_COMPONENTS', '10')))
+        else:
+            items = []
+        print json.dumps({'kind': 'List', 'items': items, 'metadata': {'resourceVersion': '1'}})
+    elif 'apply' in args:
+        # one "<kind> "<name>" configured" line per document, as kubectl prints them
+        for doc in sys.stdin.read().split("\n---\n"):
+            kind = re.search(r'^kind: (\S+)', doc, re.M)
+            name = re.search(r'^  name: (\S+)', doc, re.M)
+            if kind and name:
+                print '%s "%s" configured' % (kind.group(1).lower(), name.group(1).strip('"\''))
+    elif 'logs' in args:
+        print "log line"
+    else:
+        if '-f' in args and '-' in args:
+            sys.stdin.read()
+        print "{}"
+
+
+def terraform(args):
+    print "Apply complete! Resources: 0 added, 0 changed, 0 destroyed."
+
+
+if __name__ == '__main__':
+    time.sleep(float(os.environ.get('BENCH_LATENCY', '0')))
+    {'kubectl': kubectl, 'terraform': terraform}[sys.argv[1]](sys.argv[2:])
@@ -1,5 +1,9 @@
+import inspect
+import os
+import socket
 import sys
 from artemis.tool import Artemis
+from artemis.daemon import call_daemon
 
 
 def usage(tool):
@@ -41,7 +45,28 @@ def run_cli(tool):
             args[arg_name.replace("-", "_")] = arg_value
             prevarg = arg_name.replace("-", "_")
 
-    print method(**args)
+    socket_path = tool._get_config('daemon_socket')
+    if socket_path and os.path.exists(socket_path):
+        try:
+            result = call_daemon(socket_path, sys.argv[1], args)
+            if result is not None:
+                print result
+            return
+        except RuntimeError as e:
+            # the command failed in the daemon; fail like it would have in-process
+            sys.stderr.write("%s\n" % e)
+            sys.exit(1)
+        except socket.error:
+            # left behind by a daemon that is no longer running
+            pass
+
+    result = method(**args)
+    if inspect.isgenerator(result):
+        for chunk in result:
+            sys.stdout.write(chunk)
+            sys.stdout.flush()
+    else:
+        print result
 
 
 tool = Artemis(config_file='config.yml')
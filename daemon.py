@@ -0,0 +1,13 @@
+from artemis.tool import Artemis
+from artemis.daemon import ArtemisDaemon
+
+
+tool = Artemis(config_file='config.yml')
+
+if __name__ == '__main__':
+    daemon = ArtemisDaemon(tool, tool._get_config('daemon_socket') or 'artemis.sock')
+    print "Listening on %s" % daemon.socket_path
+    try:
+        daemon.serve_forever()
+    finally:
+        daemon.server_close()
@@ -0,0 +1,87 @@
+"""EndpointReconciler against a stub Route53 client."""
+import unittest
+
+from artemis import dns
+from artemis.dns import EndpointReconciler
+
+
+def reversed_labels(name):
+    return list(reversed(name.rstrip('.').split('.')))
+
+
+class StubRoute53(object):
+    """Lists record sets in Route53's reversed-label order, page_size at a time, and records change batches."""
+
+    def __init__(self, records, page_size=2):
+        self.records = sorted(records, key=lambda r: (reversed_labels(r['Name']), r['Type']))
+        self.page_size = page_size
+        self.batches = []
+
+    def list_resource_record_sets(self, HostedZoneId, StartRecordName, StartRecordType=None):
+        start = (reversed_labels(StartRecordName), StartRecordType or '')
+        records = [r for r in self.records if (reversed_labels(r['Name']), r['Type']) >= start]
+        page = {'ResourceRecordSets': records[:self.page_size], 'IsTruncated': len(records) > self.page_size}
+        if page['IsTruncated']:
+            page['NextRecordName'] = records[self.page_size]['Name']
+            page['NextRecordType'] = records[self.page_size]['Type']
+        return page
+
+    def change_resource_record_sets(self, HostedZoneId, ChangeBatch):
+        self.batches.append(ChangeBatch)
+
+
+def record(name, record_type, value, ttl=60):
+    return {'Name': name, 'Type': record_type, 'TTL': ttl, 'ResourceRecords': [{'Value': value}]}
+
+
+class EndpointReconcilerTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = StubRoute53([
+            record('example.com.', 'SOA', 'ns.example.com.'),
+            record('web.int.example.com.', 'CNAME', 'elb-1.aws.com'),
+            record('api.int.example.com.', 'A', '10.0.0.1'),
+            record('old.int.example.com.', 'CNAME', 'elb-old.aws.com'),
+            record('pending.int.example.com.', 'CNAME', 'elb-2.aws.com'),
+            record('web.prd.example.com.', 'CNAME', 'elb-9.aws.com'),
+        ])
+        self.reconciler = EndpointReconciler(self.conn, 'Z1')
+
+    def test_get_existing_stays_below_suffix(self):
+        self.assertEqual(sorted(self.reconciler.get_existing('int.example.com.').keys()),
+                         ['api.int.example.com.', 'old.int.example.com.', 'pending.int.example.com.',
+                          'web.int.example.com.'])
+
+    def test_plan(self):
+        existing = self.reconciler.get_existing('int.example.com.')
+        changes = self.reconciler.plan({
+            'web.int.example.com.': 'elb-1.aws.com.',   # unchanged, up to the trailing dot
+            'api.int.example.com.': 'elb-3.aws.com',    # A -> CNAME
+            'new.int.example.com.': '10.0.0.2',
+        }, existing, keep=['pending.int.example.com.'])
+        self.assertEqual([(c['Action'], c['ResourceRecordSet']['Name'], c['ResourceRecordSet']['Type']) for c in changes], [
+            ('DELETE', 'api.int.example.com.', 'A'),
+            ('UPSERT', 'api.int.example.com.', 'CNAME'),
+            ('UPSERT', 'new.int.example.com.', 'A'),
+            ('DELETE', 'old.int.example.com.', 'CNAME'),
+        ])
+
+    def test_plan_up_to_date(self):
+        existing = self.reconciler.get_existing('prd.example.com.')
+        self.assertEqual(self.reconciler.plan({'web.prd.example.com.': 'elb-9.aws.com'}, existing), [])
+        self.assertEqual(self.reconciler.reconcile('prd.example.com.', {'web.prd.example.com.': 'elb-9.aws.com'}), [])
+        self.assertEqual(self.conn.batches, [])
+
+    def test_reconcile_submits_batches(self):
+        original = dns.MAX_BATCH_CHANGES
+        dns.MAX_BATCH_CHANGES = 3
+        try:
+            changes = self.reconciler.reconcile('int.example.com.', {})
+        finally:
+            dns.MAX_BATCH_CHANGES = original
+        self.assertEqual(len(changes), 4)
+        self.assertEqual([len(b['Changes']) for b in self.conn.batches], [3, 1])
+        self.assertTrue(all(c['Action'] == 'DELETE' for b in self.conn.batches for c in b['Changes']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+"""apply_manifests of both cluster backends, against a stub API server and a stub kubectl."""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from artemis import specio
+from artemis.kube import KubectlClient, KubeError
+from artemis.kubeapi import KubeApiClient
+
+
+class StubApiHandler(BaseHTTPRequestHandler):
+    """Keeps objects by URL path; POST creates (409 if present), PATCH merges the top level."""
+
+    def do_POST(self):
+        body = self.__body()
+        path = "%s/%s" % (self.path, body['metadata']['name'])
+        if path in self.server.objects:
+            return self.__reply(409, {'kind': 'Status', 'message': 'already exists'})
+        self.server.objects[path] = body
+        self.__reply(201, body)
+
+    def do_PATCH(self):
+        if self.path not in self.server.objects:
+            return self.__reply(404, {'kind': 'Status', 'message': 'not found'})
+        self.server.objects[self.path].update(self.__body())
+        self.server.patches.append(self.path)
+        self.__reply(200, self.server.objects[self.path])
+
+    def __body(self):
+        return json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+
+    def __reply(self, status, obj):
+        data = json.dumps(obj)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+# prints the status lines kubectl apply prints, in both the old and the new format
+STUB_KUBECTL = r"""import re, sys
+with open(sys.argv[1], 'w') as f:
+    f.write(" ".join(sys.argv[2:]) + "\n" + sys.stdin.read())
+print 'replicationcontroller "web" configured'
+print 'ingress.extensions/web created'
+print 'Error from server: error when creating "STDIN": secrets "bad" is forbidden'
+sys.exit(1)
+"""
+
+
+def manifest(kind, name, **metadata):
+    metadata['name'] = name
+    return {'apiVersion': 'v1', 'kind': kind, 'metadata': metadata}
+
+
+class KubeApiClientTest(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StubApiHandler)
+        self.server.objects = {}
+        self.server.patches = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.client = KubeApiClient("http://127.0.0.1:%d" % self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_creates_then_patches_existing(self):
+        manifests = [manifest('Namespace', 'test'), manifest('ReplicationController', 'web')]
+        self.assertEqual(self.client.apply_manifests(manifests, namespace='test'),
+                         [('Namespace', 'test', 'created'), ('ReplicationController', 'web', 'created')])
+        self.assertIn('/api/v1/namespaces/test/replicationcontrollers/web', self.server.objects)
+        self.assertEqual(self.server.objects['/api/v1/namespaces/test/replicationcontrollers/web']
+                         ['metadata']['namespace'], 'test')
+
+        self.assertEqual(self.client.apply_manifests(manifests[1:], namespace='test'),
+                         [('ReplicationController', 'web', 'configured')])
+        self.assertEqual(self.server.patches, ['/api/v1/namespaces/test/replicationcontrollers/web'])
+
+    def test_keeps_explicit_namespace(self):
+        self.client.apply_manifests([manifest('Service', 'web', namespace='other')], namespace='test')
+        self.assertIn('/api/v1/namespaces/other/services/web', self.server.objects)
+
+    def test_unsupported_kind_fails_alone(self):
+        results = self.client.apply_manifests([manifest('Ingress', 'web'), manifest('Secret', 'token')],
+                                              namespace='test')
+        self.assertTrue(results[0][2].startswith('failed'))
+        self.assertEqual(results[1], ('Secret', 'token', 'created'))
+
+
+class KubectlClientTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        script = os.path.join(self.tmp_dir, 'kubectl.py')
+        with open(script, 'w') as f:
+            f.write(STUB_KUBECTL)
+        self.calls = os.path.join(self.tmp_dir, 'calls')
+        self.client = KubectlClient("%s %s %s" % (sys.executable, script, self.calls))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_one_invocation_with_statuses(self):
+        manifests = [manifest('ReplicationController', 'web'), manifest('Ingress', 'web'),
+                     manifest('Secret', 'bad'), manifest('ConfigMap', 'missing')]
+        results = self.client.apply_manifests(manifests, namespace='test')
+        self.assertEqual(results[0], ('ReplicationController', 'web', 'configured'))
+        self.assertEqual(results[1], ('Ingress', 'web', 'created'))
+        self.assertTrue(results[2][2].startswith('failed (Error from server'))
+        self.assertEqual(results[3], ('ConfigMap', 'missing', 'no result reported'))
+
+        with open(self.calls) as f:
+            args, stream = f.read().split("\n", 1)
+        self.assertEqual(args, "apply -f - --namespace=test")
+        docs = specio.load_all(stream)
+        self.assertEqual([d['kind'] for d in docs], ['ReplicationController', 'Ingress', 'Secret', 'ConfigMap'])
+        # namespaces are defaulted for known kinds; --namespace places the others in the same one
+        self.assertEqual(docs[0]['metadata']['namespace'], 'test')
+        self.assertNotIn('namespace', docs[1]['metadata'])
+
+    def test_other_namespaces_applied_separately(self):
+        self.client.apply_manifests([manifest('Service', 'web', namespace='other')], namespace='test')
+        with open(self.calls) as f:
+            self.assertEqual(f.readline().strip(), "apply -f - --namespace=other")
+
+    def test_create_passes_namespace(self):
+        self.assertRaises(KubeError, self.client.create, manifest('Ingress', 'web'), 'test')
+        with open(self.calls) as f:
+            self.assertEqual(f.readline().strip(), "create -o json -f - --namespace=test")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+"""TerraformRunner's skip-if-unchanged marker, against a stub terraform script."""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from artemis.terraform import TerraformRunner, TerraformError, APPLIED_FILE
+
+
+# logs "<directory name> <arguments> <plugin cache dir>" and fails when a FAIL file is present
+STUB_TERRAFORM = r"""import os, sys
+with open(sys.argv[1], 'a') as f:
+    f.write("%s %s %s\n" % (os.path.basename(os.getcwd()), " ".join(sys.argv[2:]), os.environ.get('TF_PLUGIN_CACHE_DIR')))
+if os.path.exists('FAIL'):
+    sys.exit(1)
+print "Apply complete!"
+"""
+
+
+class TerraformRunnerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        script = os.path.join(self.tmp_dir, 'terraform.py')
+        with open(script, 'w') as f:
+            f.write(STUB_TERRAFORM)
+        self.calls = os.path.join(self.tmp_dir, 'calls')
+        self.cache_dir = os.path.join(self.tmp_dir, 'plugins')
+        self.runner = TerraformRunner("%s %s %s" % (sys.executable, script, self.calls),
+                                      variables={'aws_access_key': 'key'}, plugin_cache_dir=self.cache_dir)
+        self.envs = []
+        for name in ('env-1', 'env-2'):
+            env_dir = os.path.join(self.tmp_dir, name)
+            os.mkdir(env_dir)
+            self.write(env_dir, 'main.tf', 'variable "env_name" { default = "%s" }\n' % name)
+            self.envs.append(env_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, env_dir, name, content):
+        with open(os.path.join(env_dir, name), 'w') as f:
+            f.write(content)
+
+    def read_calls(self):
+        if not os.path.exists(self.calls):
+            return []
+        with open(self.calls) as f:
+            calls = f.read().splitlines()
+        os.remove(self.calls)
+        return calls
+
+    def test_skips_unchanged_inputs(self):
+        env_dir = self.envs[0]
+        self.assertEqual(self.runner.apply(env_dir), "Apply complete!\nApply complete!\n")
+        self.assertEqual(self.read_calls(), ["env-1 init -input=false %s" % self.cache_dir,
+                                             "env-1 apply -var aws_access_key=key %s" % self.cache_dir])
+        self.assertTrue(os.path.isfile(os.path.join(env_dir, APPLIED_FILE)))
+
+        # state files and other outputs are not inputs
+        self.write(env_dir, 'terraform.tfstate', '{}')
+        self.assertIsNone(self.runner.apply(env_dir))
+        self.assertEqual(self.read_calls(), [])
+
+        self.write(env_dir, 'vars.tfvars', 'env_name = "other"\n')
+        self.assertIsNotNone(self.runner.apply(env_dir))
+        self.assertEqual(len(self.read_calls()), 2)
+
+        self.assertIsNotNone(self.runner.apply(env_dir, force=True))
+        self.assertEqual(len(self.read_calls()), 2)
+
+    def test_failed_apply_is_retried(self):
+        env_dir = self.envs[0]
+        self.write(env_dir, 'FAIL', '')
+        self.assertRaises(TerraformError, self.runner.apply, env_dir)
+        self.assertFalse(os.path.exists(os.path.join(env_dir, APPLIED_FILE)))
+        os.remove(os.path.join(env_dir, 'FAIL'))
+        self.read_calls()
+        self.assertIsNotNone(self.runner.apply(env_dir))
+
+    def test_destroy_forgets_apply(self):
+        env_dir = self.envs[0]
+        self.runner.apply(env_dir)
+        self.runner.destroy(env_dir)
+        self.assertFalse(os.path.exists(os.path.join(env_dir, APPLIED_FILE)))
+        self.assertIsNotNone(self.runner.apply(env_dir))
+
+    def test_no_inputs(self):
+        os.remove(os.path.join(self.envs[0], 'main.tf'))
+        self.assertIsNone(self.runner.apply(self.envs[0], force=True))
+        self.assertEqual(self.read_calls(), [])
+
+    def test_apply_all(self):
+        self.runner.apply(self.envs[0])
+        self.write(self.envs[1], 'FAIL', '')
+        results = self.runner.apply_all(self.envs)
+        self.assertEqual([r[0] for r in results], self.envs)
+        self.assertIsNone(results[0][1])
+        self.assertIsNone(results[0][2])
+        self.assertIsInstance(results[1][2][1], TerraformError)
+
+
+if __name__ == '__main__':
+    unittest.main()
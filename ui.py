@@ -1,20 +1,21 @@
 from artemis.tool import Artemis
-from threading import Thread
-from flask import Flask, render_template, request
+from artemis.jobs import JobQueue, QueueFull
+from artemis.metrics import metrics
+from flask import Flask, Response, render_template, request, stream_with_context
+import inspect
 import requests
 import simplejson as json
 import logging
 from logging.handlers import TimedRotatingFileHandler
 
 
-def async(f):
-    def wrapper(*args, **kwargs):
-        thr = Thread(target=f, args=args, kwargs=kwargs)
-        thr.start()
-    return wrapper
-
-
 tool = Artemis(config_file='config.yml')
+if tool._get_config('cluster_cache'):
+    tool.start_cluster_cache()
+
+jobs = JobQueue(workers=tool._get_config('job_workers') or 4,
+                max_pending=tool._get_config('job_max_pending') or 100)
+jobs.start()
 
 ui = Flask("artemis-ui")
 ui.config.update(
@@ -23,13 +24,16 @@ ui.config.update(
 )
 
 
-@async
 def call_image_update(env_name, component_name, image_tag):
-    tool.call_update_component(env_name, component_name, image_tag)
+    return jobs.submit((env_name, component_name),
+                       "update %s/%s to %s" % (env_name, component_name, image_tag),
+                       tool.call_update_component, (env_name, component_name, image_tag),
+                       coalesce=True)
 
-@async
 def call_recreate_component(env, component):
-    tool.call_recreate_component(env, component)
+    return jobs.submit((env, component),
+                       "recreate %s/%s" % (env, component),
+                       tool.call_recreate_component, (env, component))
 
 @ui.route('/')
 def list_environments():
@@ -40,14 +44,10 @@ def list_environments():
 @ui.route('/env/<env_name>')
 def show_environment(env_name):
     env = tool.get_environment(env_name)
-    pod_list = tool._kubectl("--namespace=%s get pods -L app" % env.get_name()).split("\n")
     components = []
-    for pod in pod_list[1:-1]:
-        pod_data = pod.split()
-        component = None
-        for c in env.get_components():
-            if c.get_name() == pod_data[5]:
-                component = c
+    pods, snapshot_age = tool.get_pod_snapshot(env.get_name())
+    for pod in pods:
+        component = env.get_component(pod.app)
         if component is None:
             continue
         components.append({
@@ -55,14 +55,15 @@ def show_environment(env_name):
             'image_name': component.get_image_basename(),
             'image_tag': component.get_image_tag(),
             'env': env,
-            'uptime': pod_data[4],
-            'pod_name': pod_data[0],
-            'status': pod_data[2]
+            'uptime': pod.uptime,
+            'pod_name': pod.name,
+            'status': pod.status
                 })
 
     return render_template("show_environment.html",
                            components=components,
-                           env=env, spec_version=tool.call_get_spec_version(env_name=env_name))
+                           env=env, spec_version=tool.call_get_spec_version(env_name=env_name),
+                           snapshot_age=snapshot_age)
 
 
 @ui.route('/call/<method_name>')
@@ -73,38 +74,67 @@ def call_method(method_name):
     except:
         return "Invalid request"
     
-    return "<pre>%s</pre>" % str(method(**args)).replace("<","&lt;")
+    result = method(**args)
+    if inspect.isgenerator(result):
+        return Response(stream_with_context(stream_pre(result)), mimetype="text/html")
+    return "<pre>%s</pre>" % str(result).replace("<","&lt;")
+
+
+def stream_pre(chunks):
+    """Wrap streamed output (e.g. logs) in <pre>, escaping each chunk as it is sent."""
+    yield "<pre>"
+    for chunk in chunks:
+        yield chunk.replace("<","&lt;")
+    yield "</pre>"
 
 @ui.route('/update/<env_name>/<component_name>/<image_tag>')
 def update_image(env_name, component_name, image_tag):
-    call_image_update(env_name, component_name, image_tag)
+    try:
+        call_image_update(env_name, component_name, image_tag)
+    except QueueFull:
+        return "Job queue is full, try again later", 503
     return "Request processing"
 
 
 @ui.route('/recreate/<env_name>/<component_name>')
 def recreate_component(env_name, component_name):
-    env = tool.get_environment(env_name)
-    component = env.get_component(component_name)
-    tool.call_recreate_component(env_name, component_name)
-    return "Recreated"
+    try:
+        call_recreate_component(env_name, component_name)
+    except QueueFull:
+        return "Job queue is full, try again later", 503
+    return "Request processing"
+
+
+@ui.route('/metrics')
+def show_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@ui.route('/jobs')
+def list_jobs():
+    return Response(json.dumps(jobs.get_jobs()), mimetype="application/json")
 
 @ui.route('/newimage/<image_vendor>/<image_name>/<branch_name>/<build_number>')
 def new_image_version(image_vendor, image_name, branch_name, build_number):
     updated_environments = []
-    for env in tool.get_environments():
-        if env.is_auto_deployed():
-            for component in env.get_components(resource_type='kube'):
-                if component.get_image_basename() != image_vendor + "/" + image_name:
-                    continue
-                try:
-                    component_branch, component_tag = component.get_image_tag().split("-")
-                except:
-                    continue
-                if component_branch == branch_name and component_tag != build_number:
-	            image_tag = '-'.join([branch_name, build_number])
-                    print "Updating %s %s with %s" % (env.get_name(), component.get_name(), component.get_image_tag())
-		    call_image_update(env.get_name(), component.get_name(), image_tag)
-                    updated_environments.append(env.get_name())
+    for env_name, component_name in tool.find_image_users(image_vendor + "/" + image_name, branch_name):
+        env = tool.get_environment(env_name)
+        if env is None or not env.is_auto_deployed():
+            continue
+        component = env.get_component(component_name)
+        try:
+            component_branch, component_tag = component.get_image_tag().split("-")
+        except:
+            continue
+        if component_branch == branch_name and component_tag != build_number:
+            image_tag = '-'.join([branch_name, build_number])
+            print "Updating %s %s with %s" % (env.get_name(), component.get_name(), component.get_image_tag())
+            try:
+                call_image_update(env.get_name(), component.get_name(), image_tag)
+            except QueueFull:
+                print "Job queue full, not updating %s %s" % (env.get_name(), component.get_name())
+                continue
+            updated_environments.append(env.get_name())
 
     if tool._get_config('slack_notification_webhook') and updated_environments:
         msg = {
@@ -119,7 +149,7 @@ def new_image_version(image_vendor, image_name, branch_name, build_number):
 
 @ui.route('/deploycheck/')
 def deploy_form():
-    return render_template("deploy_form.html", envs=tool.get_environments())
+    return render_template("deploy_form.html", envs=tool.get_environments(), matrix=tool.promotion.get_matrix())
 
 @ui.route('/deploycheck/<source>/<dest>/')
 def deploy_final(source, dest):
@@ -127,7 +157,18 @@ def deploy_final(source, dest):
 
 @ui.route('/deploy/<source>/<dest>')
 def deploy_env(source, dest):
-    tool.call_deploy_from_to(source, dest)
+    # one coalescing job per component, like webhook updates, so the two never race
+    to_update = tool.call_deploy_diff(source, dest)
+    if 'error' in to_update:
+        return to_update['error']
+    skipped = []
+    for component_name in sorted(to_update.keys()):
+        try:
+            call_image_update(dest, component_name, to_update[component_name]['source'])
+        except QueueFull:
+            skipped.append(component_name)
+    if skipped:
+        return "Job queue is full, not deploying %s" % ", ".join(skipped), 503
     return "Deploying"
 
 if __name__ == '__main__':